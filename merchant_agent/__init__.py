@@ -5,9 +5,11 @@ __author__ = "Fiuu Agentic Commerce AI"
 from .config import MerchantAgentConfig
 from .tools import MerchantTools
 from .merchant_agent import MerchantAgent
+from .session_service import SqliteSessionService
 
 __all__ = [
     "MerchantAgent",
     "MerchantAgentConfig",
     "MerchantTools",
+    "SqliteSessionService",
 ]
@@ -55,18 +55,28 @@ def create_merchant_agent(model: str, agent_name: str = 'merchant_agent', custom
                 - quantity (required): how many to add (must be > 0)
                 - variations (optional): list of selected variations with type and name
 
-            3. **view_cart** – View current cart contents
+            3. **add_items_to_cart** – Add several items to shopping cart at once
+            - Use instead of repeated add_to_cart calls when user wants to add more than one product
+            - Prices and variation modifiers are automatically calculated for all items together
+            - Parameters:
+                - items (required): list of items, each with:
+                    - product_id: the product ID
+                    - quantity: how many to add (must be > 0)
+                    - variations (optional): list of selected variations with type and name
+
+            4. **view_cart** – View current cart contents
             - Use when user asks to see their cart, response only the number of items and total amount
             - Returns: items with amounts, subtotal, shipping, and total
+            - If shipping_estimated is true, tell the user the shipping fee is an estimate
             - No parameters required
 
-            4. **remove_from_cart** – Remove item from cart
+            5. **remove_from_cart** – Remove item from cart
             - Use when user wants to remove products from cart
             - Parameters:
                 - product_id (required): the product ID to remove
                 - variations (optional): variations to match specific item
 
-            5. **create_order** – Create a new order with items
+            6. **create_order** – Create a new order with items
             - Use when user wants to checkout/purchase
             - Can use cart items or specify items directly
             - Parameters:
@@ -80,6 +90,7 @@ def create_merchant_agent(model: str, agent_name: str = 'merchant_agent', custom
             1. Read the user query carefully
             2. If searching for products → call **search_products**
             3. If adding to cart → call **add_to_cart** with product_id and quantity
+               (or **add_items_to_cart** once for several products)
             4. If viewing cart → call **view_cart**
             5. If removing from cart → call **remove_from_cart** with product_id
 
@@ -92,6 +103,7 @@ def create_merchant_agent(model: str, agent_name: str = 'merchant_agent', custom
         tools=[
             tools.search_products,
             tools.add_to_cart,
+            tools.add_items_to_cart,
             tools.view_cart,
             tools.remove_from_cart,
         ]
@@ -0,0 +1,263 @@
+"""
+Cart Journal - Append-only log of cart changes for CartService
+Keeps in-memory carts crash safe: every change is appended and fsynced in
+batches, and the journal is periodically compacted into a cart snapshot
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional
+
+from .cart_storage import Cart, CartItem, LineKey, variation_key
+
+logger = logging.getLogger(__name__)
+
+
+class CartJournal:
+    """
+    Append-only journal of cart changes.
+
+    Each record is one JSON line: a "lines" record holds the new state of
+    the lines one mutation changed (quantity 0 for removed lines), and a
+    "delete" record is the tombstone of a cleared, expired or evicted cart.
+    Records hold absolute line state rather than increments, so replaying a
+    record twice (e.g. on top of a snapshot that already includes it) is
+    harmless. Appends only queue the record; queued records are written
+    and fsynced together (group commit) every `flush_interval` seconds or
+    every `batch_size` records, on one background thread, so the mutation
+    path never waits on disk.
+
+    Compaction rotates the journal to `<path>.1` so that new records go to
+    a fresh file while a snapshot is written; the rotated file is deleted
+    once the snapshot is in place. Replay reads `<path>.1` (left behind if
+    the process died mid-compaction) and then `<path>`.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.005, batch_size: int = 256):
+        """
+        Args:
+            path: Journal file
+            flush_interval: Seconds to collect records before writing and fsyncing them
+            batch_size: Pending records that trigger an immediate write
+        """
+        self.path = path
+        self.rotated_path = f"{path}.1"
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+
+        # One worker thread owns the file, which also keeps writes in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cart-journal")
+        self._file: Optional[IO[str]] = None
+        self._executor.submit(self._open).result()
+
+        # Encoded records waiting for the next group commit
+        self._pending: List[str] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional["asyncio.Task[None]"] = None
+        self.records = 0
+        self.commits = 0
+        logger.info(f"CartJournal initialized: {path}")
+
+    # ========== Journal Thread ==========
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a", encoding="utf-8")
+        # Terminate a torn record left by a crash so it doesn't swallow the next one
+        if self._file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def _write(self, lines: List[str]) -> None:
+        self._file.write("".join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rotate(self) -> None:
+        """Move the current journal aside and start a fresh one"""
+        self._file.close()
+        if os.path.exists(self.rotated_path):
+            # An earlier compaction didn't finish; keep its records ahead of ours
+            with open(self.rotated_path, "a", encoding="utf-8") as rotated, \
+                    open(self.path, "r", encoding="utf-8") as current:
+                shutil.copyfileobj(current, rotated)
+                rotated.flush()
+                os.fsync(rotated.fileno())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.rotated_path)
+        self._open()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a file function on the journal thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # ========== Group Commit ==========
+
+    def append(self, cart: Cart) -> None:
+        """Queue the cart's changed lines (cart.changed_lines) for the next group commit"""
+        if not cart.changed_lines:
+            return
+        self._append({
+            "op": "lines",
+            "session_id": cart.session_id,
+            "created_at": cart.created_at,
+            "updated_at": cart.updated_at,
+            "items": [_line_record(line_key, cart.get_line(line_key)) for line_key in cart.changed_lines]
+        })
+
+    def append_delete(self, session_id: str) -> None:
+        """Queue a tombstone for a removed cart"""
+        self._append({"op": "delete", "session_id": session_id})
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        self._pending.append(json.dumps(record) + "\n")
+        self.records += 1
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self.flush())
+            self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: "asyncio.Task[None]") -> None:
+        """Retry a failed background flush later (its records were put back in the queue)"""
+        if task.cancelled() or task.exception() is None:
+            return
+        if self._flush_handle is None and self._file is not None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(max(self.flush_interval, 1.0), self._start_flush)
+
+    async def flush(self) -> None:
+        """
+        Write and fsync all pending records.
+        If the write fails, the records stay queued for the next flush
+        (replaying a record that was partly written before is harmless).
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                await self._run(self._write, batch)
+                self.commits += 1
+            except Exception as e:
+                self._pending[:0] = batch
+                logger.error(f"Failed to write {len(batch)} cart journal record(s): {e}")
+                raise
+
+    # ========== Compaction ==========
+
+    async def rotate(self) -> None:
+        """
+        Flush pending records and move the journal to the rotated file.
+        Records appended from now on go to a fresh journal.
+        """
+        await self.flush()
+        await self._run(self._rotate)
+
+    async def discard_rotated(self) -> None:
+        """Delete the rotated journal once a snapshot covering it is in place"""
+        if os.path.exists(self.rotated_path):
+            await self._run(os.remove, self.rotated_path)
+
+    # ========== Replay ==========
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield journaled records, oldest first (see apply_record).
+        A torn record at the end of a file (from a crash mid-write) is skipped.
+        """
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                        if not isinstance(record, dict) or "session_id" not in record:
+                            raise ValueError("not a cart journal record")
+                    except ValueError as e:
+                        logger.warning(f"Skipping unreadable cart journal record {path}:{line_number}: {e}")
+                        continue
+                    yield record
+
+    def stats(self) -> Dict[str, int]:
+        """Get record/commit counters"""
+        return {
+            "pending": len(self._pending),
+            "records": self.records,
+            "commits": self.commits,
+        }
+
+    async def close(self) -> None:
+        """Flush pending records and close the journal"""
+        await self.flush()
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+
+def _line_record(line_key: LineKey, item: Optional[CartItem]) -> Dict[str, Any]:
+    """Journaled state of one cart line (quantity 0 if it was removed)"""
+    if item is None:
+        return {
+            "product_id": line_key[0],
+            "variations": [{"type": type_, "name": name} for type_, name in line_key[1]],
+            "quantity": 0
+        }
+    record = item.to_dict()
+    record.pop("amount", None)
+    return record
+
+
+def apply_record(cart: Optional[Cart], record: Dict[str, Any]) -> Optional[Cart]:
+    """
+    Apply a journal record to a session's cart.
+
+    Args:
+        cart: The session's current cart (None if it has none)
+        record: Record from CartJournal.replay
+
+    Returns:
+        The updated cart, or None if the record deleted it
+    """
+    op = record.get("op")
+    if op == "delete":
+        return None
+    if op != "lines":
+        raise ValueError(f"Unknown cart journal record: {op}")
+
+    if cart is None:
+        cart = Cart(record["session_id"])
+        cart.created_at = record["created_at"]
+    for item in record["items"]:
+        line_key = (item["product_id"], variation_key(item.get("variations")))
+        if cart.get_line(line_key) is not None:
+            cart.remove_line(line_key)
+        if item["quantity"] > 0:
+            cart.add_line(CartItem.from_dict(item))
+    cart.updated_at = record["updated_at"]
+    cart.changed_lines = None
+    return cart
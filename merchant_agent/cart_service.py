@@ -1,15 +1,79 @@
 """
-Cart Service - In-memory cart management for merchant agent
-Stores cart data per session without database
+Cart Service - Cart management for merchant agent
+Stores cart data per session in a pluggable storage backend (in-memory by default)
 """
 
-from typing import Dict, List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Any, Optional, Tuple
 from datetime import datetime
+import asyncio
+import gzip
+import inspect
+import json
 import logging
+import math
+import os
+import time
+
+from .cart_journal import CartJournal, apply_record
+from .catalog_cache import MISSING, ProductCache, SingleFlight
+from .cart_storage import (
+    Cart, CartConflictError, CartItem, CartStorage, InMemoryCartStorage, LineKey,
+    decode_cart, encode_cart, variation_key
+)
 
 logger = logging.getLogger(__name__)
 
 
+# Cart snapshot format: gzip-compressed JSONL, a header line then one cart per line
+SNAPSHOT_FORMAT = "merchant-agent-carts"
+SNAPSHOT_VERSION = 1
+
+# Times a cart mutation is re-applied after losing a write race to another worker
+CART_SAVE_ATTEMPTS = 5
+
+
+class _SnapshotFile:
+    """
+    Snapshot being written to `<path>.tmp`; its methods do blocking file
+    I/O and gzip compression, so they run on a worker thread.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self._raw = open(self.tmp_path, "wb")
+        # Level 1: snapshots are written on shutdown, where speed matters more than size
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=1)
+    
+    def write(self, lines: List[str]) -> None:
+        self._gzip.write("".join(lines).encode("utf-8"))
+    
+    def commit(self) -> None:
+        """Make the snapshot durable, then atomically replace the previous one"""
+        self._gzip.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        os.replace(self.tmp_path, self.path)
+        # Persist the rename itself before anything relies on the new snapshot
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
+    def discard(self) -> None:
+        """Drop a partly written snapshot"""
+        try:
+            self._gzip.close()
+        finally:
+            self._raw.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
 # Lazy import to avoid circular dependency
 def _get_merchant_tools():
     """Lazy import of merchant tools to avoid circular dependency"""
@@ -23,24 +87,373 @@ def _get_merchant_tools():
 
 class CartService:
     """
-    Manages shopping carts for multiple sessions in memory.
-    Each session has its own cart identified by session_id.
+    Manages shopping carts for multiple sessions.
+    Each session has its own cart identified by session_id, kept in a
+    CartStorage backend (in-memory unless another backend is given).
+    
+    Carts are compact Cart/CartItem objects whose lines are indexed by
+    (product_id, canonical variations), so adding, updating and removing a
+    line doesn't scan the cart. Shipping is only recalculated after the
+    cart changes.
+    Cart items are converted to dicts only when a summary is returned.
+    
+    Mutations of a cart run under a per-session lock taken from a fixed
+    set of lock stripes, so concurrent updates to one cart can't interleave
+    while different shoppers rarely wait on each other. Storage shared with
+    other worker processes rejects a save if another worker changed the
+    cart first; the mutation is then re-applied to the fresh cart.
     """
     
-    def __init__(self):
-        # In-memory storage: {session_id: cart_data}
-        self._carts: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, storage: Optional[CartStorage] = None, lock_stripes: int = 256):
+        # Cart storage: {session_id: cart_data}
+        self.storage: CartStorage = storage or InMemoryCartStorage()
+        self.storage.on_remove = self._journal_removal
         # Shipping calculator: override with custom function if needed
         self.shipping_calculator = self._default_shipping_calculator
+        # Bumped when the calculator changes so cached shipping fees are recalculated
+        self._shipping_version = 0
+        # Stable ID of the calculator, under which fees are persisted with carts (None keeps them in-process)
+        self.shipping_calculator_id: Optional[str] = None
+        # Memoized calculator results by (subtotal bucket, item count); disabled by default
+        self._shipping_cache = ProductCache(ttl=0)
+        self._shipping_flights = SingleFlight()
+        self._subtotal_bucket = 0.01
+        # Background task expiring inactive carts
+        self._sweeper: Optional["asyncio.Task[None]"] = None
+        # Optional journal of cart changes, and the task compacting it into snapshots
+        self.journal: Optional[CartJournal] = None
+        self._compactor: Optional["asyncio.Task[None]"] = None
+        # Striped per-session mutation locks, created in the running loop on first use
+        self._lock_stripes = max(1, lock_stripes)
+        self._locks_state: Optional[Tuple[asyncio.AbstractEventLoop, List[asyncio.Lock]]] = None
+        self.lock_acquisitions = 0
+        self.lock_contentions = 0
         logger.info("CartService initialized")
     
+    def set_storage(self, storage: CartStorage) -> None:
+        """
+        Set the storage backend for carts.
+        
+        Args:
+            storage: CartStorage implementation (e.g. SqliteCartStorage)
+        """
+        self.storage = storage
+        self.storage.on_remove = self._journal_removal
+        logger.info(f"Cart storage set: {storage.__class__.__name__}")
+    
+    def set_journal(self, journal: Optional[CartJournal]) -> None:
+        """
+        Set the journal every cart change is appended to (None disables journaling).
+        
+        Args:
+            journal: CartJournal to append to
+        """
+        self.journal = journal
+        logger.info(f"Cart journal set: {journal.path if journal else None}")
+    
+    def start_sweeper(self, interval: float = 60.0) -> None:
+        """
+        Start a background task that expires inactive carts.
+        Must be called from a running event loop; does nothing if already running.
+        
+        Args:
+            interval: Seconds between expiry sweeps
+        """
+        if self._sweeper is not None and not self._sweeper.done():
+            return
+        self._sweeper = asyncio.ensure_future(self._sweep_loop(interval))
+        logger.info(f"Cart sweeper started (every {interval}s)")
+    
+    async def stop_sweeper(self) -> None:
+        """Stop the background expiry task"""
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        try:
+            await self._sweeper
+        except asyncio.CancelledError:
+            pass
+        self._sweeper = None
+        logger.info("Cart sweeper stopped")
+    
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                expired = await self.storage.expire()
+                if expired:
+                    logger.info(f"Expired {expired} inactive cart(s)")
+            except Exception as e:
+                logger.error(f"Cart expiry sweep failed: {e}")
+    
+    async def snapshot(self, path: str, chunk_size: int = 1000) -> int:
+        """
+        Write every cart to a compressed snapshot file for a warm restart.
+        Carts are encoded in chunks, so memory doesn't grow with the number
+        of carts; compressing and writing a chunk happens on a worker thread.
+        The file is written next to `path`, fsynced and renamed into place
+        (and the rename fsynced), so a crash mid-dump keeps the previous
+        snapshot and a returned snapshot survives power loss.
+        
+        Args:
+            path: Snapshot file (gzip-compressed JSONL)
+            chunk_size: Carts encoded per chunk handed to the writer thread
+            
+        Returns:
+            Number of carts written
+        """
+        count = 0
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        # One thread, so writes, commit and discard run in order
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cart-snapshot")
+        snapshot_file = None
+        try:
+            snapshot_file = await loop.run_in_executor(executor, _SnapshotFile, path)
+            lines = [json.dumps({"format": SNAPSHOT_FORMAT, "version": SNAPSHOT_VERSION}) + "\n"]
+            async for cart in self.storage.iter_carts():
+                lines.append(encode_cart(cart) + "\n")
+                count += 1
+                if len(lines) >= chunk_size:
+                    await loop.run_in_executor(executor, snapshot_file.write, lines)
+                    lines = []
+            await loop.run_in_executor(executor, snapshot_file.write, lines)
+            await loop.run_in_executor(executor, snapshot_file.commit)
+        except BaseException:
+            if snapshot_file is not None:
+                executor.submit(snapshot_file.discard)
+            raise
+        finally:
+            executor.shutdown(wait=False)
+        
+        logger.info(f"Saved {count} cart(s) to {path} in {time.monotonic() - started:.2f}s")
+        return count
+    
+    async def restore(self, path: str, max_age: float = 0, chunk_size: int = 1000) -> int:
+        """
+        Load carts from a snapshot written by snapshot().
+        Carts are read and stored one at a time; restored carts replace any
+        cart already stored for the same session.
+        
+        Args:
+            path: Snapshot file
+            max_age: Skip carts not updated within this many seconds (0 keeps all)
+            chunk_size: Carts restored between yields to the event loop
+            
+        Returns:
+            Number of carts restored (0 if the file doesn't exist)
+        """
+        if not os.path.exists(path):
+            logger.info(f"No cart snapshot at {path}")
+            return 0
+        
+        started = time.monotonic()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("format") != SNAPSHOT_FORMAT or header.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported cart snapshot: {path}")
+            
+            count, skipped = await self._load_carts(
+                (decode_cart(line) for line in f), max_age, chunk_size
+            )
+        
+        logger.info(
+            f"Restored {count} cart(s) from {path} in {time.monotonic() - started:.2f}s"
+            f" ({skipped} expired)"
+        )
+        return count
+    
+    async def _load_carts(
+        self,
+        carts: Iterator[Cart],
+        max_age: float,
+        chunk_size: int
+    ) -> Tuple[int, int]:
+        """Store carts (without journaling them), skipping expired ones; returns (stored, skipped)"""
+        cutoff = time.time() - max_age if max_age > 0 else None
+        count = 0
+        skipped = 0
+        for cart in carts:
+            if cutoff is not None and cart.updated_at < cutoff:
+                skipped += 1
+                continue
+            try:
+                await self.storage.put(cart.session_id, cart)
+            except CartConflictError:
+                # Loaded carts replace stored ones
+                stored = await self.storage.get(cart.session_id)
+                cart.version = stored.version if stored is not None else 0
+                await self.storage.put(cart.session_id, cart)
+            count += 1
+            if count % chunk_size == 0:
+                await asyncio.sleep(0)
+        return count, skipped
+    
+    async def recover(self, snapshot_path: str, max_age: float = 0) -> int:
+        """
+        Rebuild carts after a restart or crash: restore the snapshot, replay
+        the journal on top of it, then compact so the journal starts empty.
+        
+        Args:
+            snapshot_path: Snapshot file the journal is compacted into
+            max_age: Skip carts not updated within this many seconds (0 keeps all)
+            
+        Returns:
+            Number of carts stored
+        """
+        count = await self.restore(snapshot_path, max_age)
+        if self.journal is None:
+            return count
+        
+        started = time.monotonic()
+        replayed, skipped = await self._replay_journal(max_age, 1000)
+        logger.info(
+            f"Replayed {replayed} cart journal record(s) in {time.monotonic() - started:.2f}s"
+            f" ({skipped} expired)"
+        )
+        await self.compact(snapshot_path)
+        return await self.storage.count()
+    
+    async def _replay_journal(self, max_age: float, chunk_size: int) -> Tuple[int, int]:
+        """Apply journal records to stored carts (without journaling them again); returns (replayed, expired)"""
+        cutoff = time.time() - max_age if max_age > 0 else None
+        replayed = 0
+        expired = 0
+        for record in self.journal.replay():
+            session_id = record["session_id"]
+            try:
+                cart = apply_record(await self.storage.get(session_id), record)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping bad cart journal record for {session_id}: {e}")
+                continue
+            
+            if cart is not None and cutoff is not None and cart.updated_at < cutoff:
+                expired += 1
+                cart = None
+            if cart is None:
+                await self.storage.delete(session_id)
+            else:
+                await self.storage.put(session_id, cart)
+            replayed += 1
+            if replayed % chunk_size == 0:
+                await asyncio.sleep(0)
+        return replayed, expired
+    
+    async def compact(self, snapshot_path: str) -> int:
+        """
+        Fold the journal into a fresh snapshot.
+        The journal is rotated first, so changes made while the snapshot is
+        written go to the new journal; the rotated journal is deleted only
+        after the snapshot is in place.
+        
+        Args:
+            snapshot_path: Snapshot file to write
+            
+        Returns:
+            Number of carts written
+        """
+        if self.journal is not None:
+            await self.journal.rotate()
+        count = await self.snapshot(snapshot_path)
+        if self.journal is not None:
+            await self.journal.discard_rotated()
+        return count
+    
+    def start_compactor(self, snapshot_path: str, interval: float = 300.0) -> None:
+        """
+        Start a background task that compacts the journal into a snapshot.
+        Must be called from a running event loop; does nothing if already running.
+        
+        Args:
+            snapshot_path: Snapshot file to write
+            interval: Seconds between compactions
+        """
+        if self._compactor is not None and not self._compactor.done():
+            return
+        self._compactor = asyncio.ensure_future(self._compact_loop(snapshot_path, interval))
+        logger.info(f"Cart journal compactor started (every {interval}s)")
+    
+    async def stop_compactor(self) -> None:
+        """Stop the background compaction task"""
+        if self._compactor is None:
+            return
+        self._compactor.cancel()
+        try:
+            await self._compactor
+        except asyncio.CancelledError:
+            pass
+        self._compactor = None
+        logger.info("Cart journal compactor stopped")
+    
+    async def _compact_loop(self, snapshot_path: str, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.compact(snapshot_path)
+            except Exception as e:
+                logger.error(f"Cart journal compaction failed: {e}")
+    
+    async def _save(self, session_id: str, cart: Cart) -> None:
+        """Store a changed cart and append its changed lines to the journal"""
+        await self.storage.put(session_id, cart)
+        if self.journal is not None:
+            self.journal.append(cart)
+        cart.changed_lines = None
+    
+    def _journal_removal(self, session_id: str) -> None:
+        """Journal a tombstone for a cart the storage expired or evicted"""
+        if self.journal is not None:
+            self.journal.append_delete(session_id)
+    
+    async def _update(
+        self,
+        session_id: str,
+        mutate: Callable[[Cart], Awaitable[bool]],
+        create: bool = False
+    ) -> Optional[Cart]:
+        """
+        Read, mutate and save a session's cart under its lock.
+        If another worker saved the cart in between, the cart is read again
+        and the mutation re-applied.
+        
+        Args:
+            session_id: User session identifier
+            mutate: Applies the change to the cart; returns False if nothing changed
+            create: Start an empty cart if the session has none
+            
+        Returns:
+            The cart after the mutation (None if there is no cart and create is False)
+        """
+        attempt = 1
+        async with self._session_lock(session_id):
+            while True:
+                cart = await self.storage.get(session_id)
+                if cart is None:
+                    if not create:
+                        return None
+                    cart = Cart(session_id)
+                
+                if not await mutate(cart):
+                    return cart
+                
+                self._mark_changed(cart)
+                try:
+                    await self._save(session_id, cart)
+                    return cart
+                except CartConflictError as e:
+                    if attempt >= CART_SAVE_ATTEMPTS:
+                        raise
+                    attempt += 1
+                    logger.debug(f"{e}; retrying (attempt {attempt})")
+    
     async def add_to_cart(
         self,
         session_id: str,
         product_id: str,
         quantity: int,
         variations: Optional[List[Dict[str, str]]] = None,
-        unit_price: Optional[float] = None
+        unit_price: Optional[float] = None,
+        product: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         Add item to cart. If item exists, update quantity.
@@ -52,77 +465,87 @@ class CartService:
             quantity: Quantity to add (must be > 0)
             variations: Optional product variations
             unit_price: Price per unit (optional, for tracking amounts)
+            product: Product record with name and image, if the caller already has it
+                     (skips the catalog lookup)
             
         Returns:
             Updated cart data
         """
-        if quantity <= 0:
-            raise ValueError("Quantity must be greater than 0")
+        return await self.add_many(session_id, [{
+            "product_id": product_id,
+            "quantity": quantity,
+            "variations": variations,
+            "unit_price": unit_price,
+            "product": product,
+        }])
+    
+    async def add_many(self, session_id: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Add several items to cart in one update. Items already in the cart
+        have their quantity increased. Product names and images for new lines
+        are fetched in one batch.
         
-        # Initialize cart if doesn't exist
-        if session_id not in self._carts:
-            self._carts[session_id] = {
-                "session_id": session_id,
-                "items": [],
-                "shipping_fee": 0.0,
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }
+        Args:
+            session_id: User session identifier
+            items: List of dicts with product_id, quantity (> 0) and optional
+                   variations, unit_price and product (see add_to_cart)
+            
+        Returns:
+            Updated cart data
+        """
+        for item in items:
+            if item["quantity"] <= 0:
+                raise ValueError("Quantity must be greater than 0")
         
-        cart = self._carts[session_id]
+        keyed_items = [
+            ((item["product_id"], variation_key(item.get("variations"))), item)
+            for item in items
+        ]
         
-        # Check if item already exists (same product_id and variations)
-        existing_item = None
-        for item in cart["items"]:
-            if item["product_id"] == product_id:
-                # Compare variations
-                item_vars = item.get("variations") or []
-                new_vars = variations or []
-                if self._variations_match(item_vars, new_vars):
-                    existing_item = item
-                    break
+        # Look up product info for new lines before locking, so catalog
+        # latency doesn't hold up other mutations behind the lock
+        cart = await self.storage.get(session_id)
+        products = await self._fetch_products(self._lines_needing_products(cart, keyed_items))
         
-        if existing_item:
-            # Update quantity
-            existing_item["quantity"] += quantity
-            if "unit_price" in existing_item:
-                existing_item["amount"] = existing_item["unit_price"] * existing_item["quantity"]
-            logger.info(f"Updated cart item {product_id} quantity to {existing_item['quantity']}")
-        else:
-            # Add new item
-            item_dict = {
-                "product_id": product_id,
-                "quantity": quantity,
-                "variations": variations or []
-            }
-            # Include unit_price if provided
-            if unit_price is not None:
-                item_dict["unit_price"] = unit_price
-                item_dict["amount"] = unit_price * quantity
-            
-            item_dict["product_name"] = ""
-            item_dict["product_image"] = ""
-            merchant_tools = _get_merchant_tools()
-            if merchant_tools:
-                try:
-                    # Get product details to fetch name and image
-                    products = await merchant_tools.get_products(product_id=product_id, limit=1)
-                    if products and len(products) > 0:
-                        product = products[0]
-                        item_dict["product_name"] = product.get("name", "")
-                        item_dict["product_image"] = product.get("image", "")
-                        logger.info(f"Fetched product info for {product_id}: {product.get('name')}")
-                except Exception as e:
-                    logger.debug(f"Could not fetch product info for {product_id}: {e}")
+        async def add(cart: Cart) -> bool:
+            # Lines removed concurrently after the unlocked check
+            missing = [
+                product_id for product_id in self._lines_needing_products(cart, keyed_items)
+                if product_id not in products
+            ]
+            if missing:
+                products.update(await self._fetch_products(missing))
             
-            cart["items"].append(item_dict)
-            logger.info(f"Added new item {product_id} to cart")
+            for line_key, item in keyed_items:
+                self._add_line(cart, line_key, item, products.get(line_key[0]))
+            return True
         
-        cart["updated_at"] = datetime.now().isoformat()
+        # Initialize cart if doesn't exist
+        cart = await self._update(session_id, add, create=True)
         
-        return self._get_cart_summary(session_id)
+        # Outside the lock, so a slow shipping calculator doesn't hold up other carts on this stripe
+        return await self._get_cart_summary(session_id, cart)
     
-    def view_cart(self, session_id: str) -> Dict[str, Any]:
+    async def clear_cart(self, session_id: str) -> bool:
+        """
+        Delete a session's cart (e.g. after its order was placed).
+        
+        Args:
+            session_id: User session identifier
+            
+        Returns:
+            True if the session had a cart
+        """
+        async with self._session_lock(session_id):
+            deleted = await self.storage.delete(session_id)
+            if deleted and self.journal is not None:
+                self.journal.append_delete(session_id)
+        
+        if deleted:
+            logger.info(f"Cleared cart for session {session_id}")
+        return deleted
+    
+    async def view_cart(self, session_id: str) -> Dict[str, Any]:
         """
         Get cart contents for a session.
         
@@ -132,17 +555,13 @@ class CartService:
         Returns:
             Cart data with items
         """
-        if session_id not in self._carts:
-            return {
-                "session_id": session_id,
-                "items": [],
-                "item_count": 0,
-                "message": "Cart is empty"
-            }
+        cart = await self.storage.get(session_id)
+        if cart is None:
+            return self._empty_cart(session_id)
         
-        return self._get_cart_summary(session_id)
+        return await self._get_cart_summary(session_id, cart)
     
-    def remove_from_cart(
+    async def remove_from_cart(
         self,
         session_id: str,
         product_id: str,
@@ -159,51 +578,118 @@ class CartService:
         Returns:
             Updated cart data
         """
-        if session_id not in self._carts:
-            return {
-                "session_id": session_id,
-                "items": [],
-                "item_count": 0,
-                "message": "Cart is empty"
-            }
+        return await self.remove_many(session_id, [{
+            "product_id": product_id,
+            "variations": variations,
+        }])
+    
+    async def remove_many(self, session_id: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Remove several items from cart in one update.
         
-        cart = self._carts[session_id]
-        original_count = len(cart["items"])
+        Args:
+            session_id: User session identifier
+            items: List of dicts with product_id and optional variations
+                   (without variations, every line of that product is removed)
+            
+        Returns:
+            Updated cart data
+        """
+        async def remove(cart: Cart) -> bool:
+            removed_count = 0
+            for item in items:
+                removed = self._remove_lines(cart, item["product_id"], item.get("variations"))
+                if not removed:
+                    logger.info(f"Item {item['product_id']} not found in cart")
+                removed_count += removed
+            
+            if removed_count > 0:
+                logger.info(f"Removed {removed_count} item(s) from cart")
+            return removed_count > 0
         
-        # Remove matching item
-        if variations is None:
-            # Remove all items with this product_id
-            cart["items"] = [
-                item for item in cart["items"]
-                if item["product_id"] != product_id
-            ]
-        else:
-            cart["items"] = [
-                item for item in cart["items"]
-                if not (
-                    item["product_id"] == product_id and
-                    self._variations_match(item.get("variations", []), variations)
-                )
-            ]
+        cart = await self._update(session_id, remove)
+        if cart is None:
+            return self._empty_cart(session_id)
+        
+        return await self._get_cart_summary(session_id, cart)
+    
+    async def set_quantity(
+        self,
+        session_id: str,
+        product_id: str,
+        quantity: int,
+        variations: Optional[List[Dict[str, str]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Set the quantity of an item already in the cart (0 removes it).
         
-        removed_count = original_count - len(cart["items"])
+        Args:
+            session_id: User session identifier
+            product_id: Product ID to update
+            quantity: New quantity (must be >= 0)
+            variations: Variations of the cart line to update
+            
+        Returns:
+            Updated cart data
+        """
+        if quantity < 0:
+            raise ValueError("Quantity cannot be negative")
         
-        if removed_count > 0:
-            cart["updated_at"] = datetime.now().isoformat()
-            logger.info(f"Removed {removed_count} item(s) from cart")
-        else:
-            logger.info(f"Item {product_id} not found in cart")
+        line_key: LineKey = (product_id, variation_key(variations))
         
-        return self._get_cart_summary(session_id)
+        async def update(cart: Cart) -> bool:
+            item = cart.get_line(line_key)
+            if item is None:
+                if quantity == 0:
+                    return False
+                raise ValueError(f"Item {product_id} is not in the cart")
+            
+            if quantity == 0:
+                cart.remove_line(line_key)
+            else:
+                cart.set_quantity(line_key, quantity)
+            logger.info(f"Set cart item {product_id} quantity to {quantity}")
+            return True
+        
+        cart = await self._update(session_id, update)
+        if cart is None:
+            if quantity == 0:
+                return self._empty_cart(session_id)
+            raise ValueError(f"Item {product_id} is not in the cart")
+        
+        return await self._get_cart_summary(session_id, cart)
     
-    def set_shipping_calculator(self, calculator_func):
+    def set_shipping_calculator(
+        self,
+        calculator_func,
+        memo_ttl: float = 0,
+        subtotal_bucket: float = 0.01,
+        memo_max_entries: int = 10000,
+        calculator_id: Optional[str] = None
+    ):
         """
         Set a custom shipping calculator function.
         
         Args:
-            calculator_func: Function that takes (subtotal, item_count, items) and returns shipping fee
+            calculator_func: Function (or async function, e.g. calling a carrier-rate
+                             service) that takes (subtotal, item_count, items) and
+                             returns shipping fee
+            memo_ttl: Seconds to reuse a fee for the same subtotal bucket and item count
+                      (0 disables memoization; only enable it if the fee doesn't depend
+                      on anything else in items)
+            subtotal_bucket: Width of the subtotal buckets fees are memoized by
+            memo_max_entries: Maximum memoized fees before least recently used are evicted
+            calculator_id: Stable ID of this calculator's rates (change it whenever the rates
+                           change); with storage shared across processes and restarts, fees
+                           are stored with carts under this ID and reused by every worker
+                           using the same ID. Without it fees are only cached in-process
         """
         self.shipping_calculator = calculator_func
+        self.shipping_calculator_id = calculator_id
+        # Carts hold shipping fees from the previous calculator
+        self._shipping_version += 1
+        self._shipping_cache = ProductCache(ttl=memo_ttl, max_entries=memo_max_entries)
+        self._subtotal_bucket = subtotal_bucket
         logger.info("Custom shipping calculator set")
     
     def _default_shipping_calculator(self, subtotal: float, item_count: int, items: List[Dict]) -> float:
@@ -229,70 +715,224 @@ class CartService:
         
         return base_fee + additional_fee
     
-    def _recalculate_shipping(self, session_id: str) -> float:
+    def _add_line(
+        self,
+        cart: Cart,
+        line_key: LineKey,
+        item: Dict[str, Any],
+        product: Optional[Dict[str, Any]]
+    ) -> None:
+        """Add one item to a cart, merging it into an existing line with the same key"""
+        product_id = line_key[0]
+        quantity = item["quantity"]
+        
+        # Check if item already exists (same product_id and variations)
+        existing_item = cart.get_line(line_key)
+        
+        if existing_item:
+            # Update quantity
+            cart.set_quantity(line_key, existing_item.quantity + quantity)
+            logger.info(f"Updated cart item {product_id} quantity to {existing_item.quantity}")
+            return
+        
+        # Add new item
+        product = item.get("product") or product
+        cart.add_line(CartItem(
+            product_id=product_id,
+            quantity=quantity,
+            variations=line_key[1],
+            unit_price=item.get("unit_price"),
+            product_name=(product.get("name") or "") if product else "",
+            product_image=(product.get("image") or "") if product else ""
+        ))
+        logger.info(f"Added new item {product_id} to cart")
+    
+    def _remove_lines(
+        self,
+        cart: Cart,
+        product_id: str,
+        variations: Optional[List[Dict[str, str]]]
+    ) -> int:
+        """Remove matching lines from a cart (all lines of the product if variations is None)"""
+        product_lines = cart.lines.get(product_id, {})
+        
+        # Remove matching item
+        removed_keys: List[LineKey]
+        if variations is None:
+            # Remove all items with this product_id
+            removed_keys = [(product_id, key) for key in product_lines]
+        else:
+            key = variation_key(variations)
+            removed_keys = [(product_id, key)] if key in product_lines else []
+        
+        for line_key in removed_keys:
+            cart.remove_line(line_key)
+        
+        return len(removed_keys)
+    
+    @staticmethod
+    def _lines_needing_products(
+        cart: Optional[Cart],
+        keyed_items: List[Tuple[LineKey, Dict[str, Any]]]
+    ) -> List[str]:
+        """Product IDs of items that would start a new line without a product record"""
+        return list(dict.fromkeys(
+            line_key[0] for line_key, item in keyed_items
+            if item.get("product") is None and (cart is None or cart.get_line(line_key) is None)
+        ))
+    
+    async def _fetch_products(self, product_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get product details (name, image) from the merchant catalog; None for unknown products"""
+        products: Dict[str, Optional[Dict[str, Any]]] = {product_id: None for product_id in product_ids}
+        merchant_tools = _get_merchant_tools()
+        if not product_ids or not merchant_tools:
+            return products
+        try:
+            products.update(await merchant_tools.get_products_by_ids_cached(product_ids))
+            logger.info(f"Fetched product info for {len(product_ids)} product(s)")
+        except Exception as e:
+            logger.debug(f"Could not fetch product info for {product_ids}: {e}")
+        return products
+    
+    @staticmethod
+    def _empty_cart(session_id: str) -> Dict[str, Any]:
+        """Response for a session without a cart"""
+        return {
+            "session_id": session_id,
+            "items": [],
+            "item_count": 0,
+            "message": "Cart is empty"
+        }
+    
+    def _locks(self) -> List[asyncio.Lock]:
+        """Lock stripes, created in (and tied to) the running loop"""
+        loop = asyncio.get_running_loop()
+        state = self._locks_state
+        if state is None or state[0] is not loop:
+            state = self._locks_state = (loop, [asyncio.Lock() for _ in range(self._lock_stripes)])
+        return state[1]
+    
+    @asynccontextmanager
+    async def _session_lock(self, session_id: str) -> AsyncIterator[None]:
+        """Hold the lock stripe for a session while mutating its cart"""
+        lock = self._locks()[hash(session_id) % self._lock_stripes]
+        self.lock_acquisitions += 1
+        if lock.locked():
+            self.lock_contentions += 1
+        async with lock:
+            yield
+    
+    def lock_stats(self) -> Dict[str, int]:
+        """Get cart lock acquisition/contention counters"""
+        return {
+            "stripes": self._lock_stripes,
+            "acquisitions": self.lock_acquisitions,
+            "contentions": self.lock_contentions,
+        }
+    
+    async def _recalculate_shipping(self, subtotal: float, items: List[Dict[str, Any]]) -> float:
         """
         Recalculate shipping fee based on current cart contents.
+        Uses a memoized fee for the same subtotal bucket and item count if
+        memoization is enabled, and coalesces concurrent identical requests.
         
         Args:
-            session_id: User session identifier
+            subtotal: Cart subtotal
+            items: Cart items as dicts
             
         Returns:
             New shipping fee amount
         """
-        if session_id not in self._carts:
-            return 0.0
+        if not self._shipping_cache.enabled:
+            return max(0.0, await self._call_shipping_calculator(subtotal, items))
         
-        cart = self._carts[session_id]
-        items = cart.get("items", [])
-        
-        # Calculate subtotal
-        subtotal = sum(item.get("amount", 0) for item in items)
-        item_count = len(items)
-        
-        # Use the shipping calculator
-        shipping_fee = self.shipping_calculator(subtotal, item_count, items)
+        key = (round(subtotal / self._subtotal_bucket), len(items))
+        shipping_fee = self._shipping_cache.get(key)
+        if shipping_fee is MISSING:
+            version = self._shipping_version
+            shipping_fee = await self._shipping_flights.do(
+                (version,) + key, lambda: self._call_shipping_calculator(subtotal, items)
+            )
+            if version == self._shipping_version:
+                self._shipping_cache.set(key, shipping_fee)
         
         return max(0.0, shipping_fee)
     
-    def _variations_match(
-        self,
-        vars1: List[Dict[str, str]],
-        vars2: List[Dict[str, str]]
-    ) -> bool:
-        """Check if two variation lists are equivalent"""
-        if len(vars1) != len(vars2):
-            return False
-        
-        # Sort and compare
-        sorted1 = sorted(vars1, key=lambda x: (x.get("type", ""), x.get("name", "")))
-        sorted2 = sorted(vars2, key=lambda x: (x.get("type", ""), x.get("name", "")))
-        
-        return sorted1 == sorted2
+    async def _call_shipping_calculator(self, subtotal: float, items: List[Dict[str, Any]]) -> float:
+        """Run the shipping calculator, awaiting it if it is async"""
+        # Use the shipping calculator
+        shipping_fee = self.shipping_calculator(subtotal, len(items), items)
+        if inspect.isawaitable(shipping_fee):
+            shipping_fee = await shipping_fee
+        return shipping_fee
+    
+    def _mark_changed(self, cart: Cart) -> None:
+        """Record a cart mutation so shipping is recalculated on next read"""
+        cart.shipping_version = None
+        cart.shipping_calculator = None
+        cart.updated_at = time.time()
     
-    def _get_cart_summary(self, session_id: str) -> Dict[str, Any]:
+    async def _get_cart_summary(self, session_id: str, cart: Cart) -> Dict[str, Any]:
         """Get cart summary with item count, subtotal, shipping, and total"""
-        cart = self._carts.get(session_id, {"items": [], "shipping_fee": 0.0})
-        
-        # Calculate subtotal from items with amounts
-        subtotal = 0.0
-        for item in cart.get("items", []):
-            if "amount" in item:
-                subtotal += item["amount"]
+        items = [item.to_dict() for item in cart.items()]
+        # Summed exactly, so adding and removing lines never leaves float residue
+        subtotal = math.fsum(item.amount for item in cart.items())
+        updated_at = cart.updated_at
         
-        # Auto-recalculate shipping based on cart contents
-        shipping_fee = self._recalculate_shipping(session_id)
-        
-        total_amount = subtotal + shipping_fee
+        # Recalculate shipping only when cart contents or the calculator changed
+        shipping_fee = cart.shipping_fee
+        shipping_estimated = False
+        calculator_id = self.shipping_calculator_id
+        if cart.shipping_version != self._shipping_version:
+            if calculator_id is not None and cart.shipping_calculator == calculator_id:
+                # Fee stored with the cart by a worker using the same calculator
+                cart.shipping_version = self._shipping_version
+            else:
+                shipping_fee, shipping_estimated = await self._update_shipping(session_id, cart, subtotal, items)
         
         return {
             "session_id": session_id,
-            "items": cart.get("items", []),
-            "item_count": len(cart.get("items", [])),
+            "items": items,
+            "item_count": len(items),
             "subtotal": subtotal,
             "shipping_fee": shipping_fee,
-            "total_amount": total_amount,
-            "updated_at": cart.get("updated_at", "")
+            "shipping_estimated": shipping_estimated,
+            "total_amount": subtotal + shipping_fee,
+            "updated_at": datetime.fromtimestamp(updated_at).isoformat()
         }
+    
+    async def _update_shipping(
+        self,
+        session_id: str,
+        cart: Cart,
+        subtotal: float,
+        items: List[Dict[str, Any]]
+    ) -> Tuple[float, bool]:
+        """Calculate a cart's shipping fee and cache it with the cart; returns (fee, estimated)"""
+        updated_at = cart.updated_at
+        version = self._shipping_version
+        try:
+            shipping_fee = await self._recalculate_shipping(subtotal, items)
+        except Exception as e:
+            # Quote the default rates as an estimate and retry the calculator on the next read
+            logger.error(f"Shipping calculator failed, estimating with default rates: {e}")
+            return self._default_shipping_calculator(subtotal, len(items), items), True
+        
+        # Keep the fee only if the cart didn't change while the calculator ran
+        if cart.updated_at == updated_at and version == self._shipping_version:
+            cart.shipping_fee = shipping_fee
+            cart.shipping_version = version
+            if self.shipping_calculator_id is not None:
+                cart.shipping_calculator = self.shipping_calculator_id
+                await self._store_shipping(session_id, cart)
+        return shipping_fee, False
+    
+    async def _store_shipping(self, session_id: str, cart: Cart) -> None:
+        """Persist a cart's computed shipping fee; failing to is only a missed cache write"""
+        try:
+            await self.storage.put_shipping(session_id, cart)
+        except Exception as e:
+            logger.warning(f"Could not store shipping fee for cart {session_id}: {e}")
 
 
 # Global cart service instance
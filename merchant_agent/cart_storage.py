@@ -0,0 +1,524 @@
+"""
+Cart Storage - Storage backends for CartService
+In-memory by default; SQLite (WAL mode) lets several worker processes share carts
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Canonical variation key: sorted (type, name) pairs
+VariationKey = Tuple[Tuple[str, str], ...]
+
+# Cart line key: (product_id, canonical variation key)
+LineKey = Tuple[str, VariationKey]
+
+
+# ============================================================
+# Cart Layout
+# ============================================================
+
+def _variation_text(value: Any) -> str:
+    """Interned string form of a variation type or name (None becomes "")"""
+    return sys.intern("" if value is None else str(value))
+
+
+def variation_key(variations: Optional[List[Dict[str, str]]]) -> VariationKey:
+    """Canonical, order-independent key for a variation list, with interned strings"""
+    return tuple(sorted(
+        (_variation_text(v.get("type")), _variation_text(v.get("name"))) for v in variations or []
+    ))
+
+
+class CartItem:
+    """
+    One cart line in compact form.
+    Variations are kept as the canonical variation key; the dict shape used
+    in cart summaries is produced by to_dict().
+    """
+
+    __slots__ = ("product_id", "quantity", "variations", "unit_price", "product_name", "product_image")
+
+    def __init__(
+        self,
+        product_id: str,
+        quantity: int,
+        variations: VariationKey = (),
+        unit_price: Optional[float] = None,
+        product_name: str = "",
+        product_image: str = ""
+    ):
+        self.product_id = sys.intern(product_id)
+        self.quantity = quantity
+        self.variations = variations
+        self.unit_price = unit_price
+        self.product_name = sys.intern(product_name) if product_name else ""
+        self.product_image = product_image or ""
+
+    @property
+    def amount(self) -> float:
+        """Line amount (0 when the item has no unit price)"""
+        return self.unit_price * self.quantity if self.unit_price is not None else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to the cart item dict returned in cart summaries"""
+        item = {
+            "product_id": self.product_id,
+            "quantity": self.quantity,
+            "variations": [{"type": type_, "name": name} for type_, name in self.variations]
+        }
+        if self.unit_price is not None:
+            item["unit_price"] = self.unit_price
+            item["amount"] = self.amount
+        item["product_name"] = self.product_name
+        item["product_image"] = self.product_image
+        return item
+
+    @classmethod
+    def from_dict(cls, item: Dict[str, Any]) -> "CartItem":
+        """Build from a cart item dict"""
+        return cls(
+            product_id=item["product_id"],
+            quantity=item["quantity"],
+            variations=variation_key(item.get("variations")),
+            unit_price=item.get("unit_price"),
+            product_name=item.get("product_name") or "",
+            product_image=item.get("product_image") or ""
+        )
+
+
+class Cart:
+    """
+    One session's cart in compact form.
+    Lines are nested by product_id, then variation key, so lookups by line
+    key and by product share one index. The shipping fee is cached until
+    the cart changes. Timestamps are epoch seconds; ISO strings are only
+    produced for cart summaries.
+    Keys of lines added, changed or removed since the cart was last saved
+    are collected in changed_lines, so only those need journaling.
+    """
+
+    __slots__ = (
+        "session_id", "lines", "shipping_fee", "shipping_version",
+        "shipping_calculator", "created_at", "updated_at", "version", "changed_lines"
+    )
+
+    def __init__(self, session_id: str):
+        now = time.time()
+        self.session_id = session_id
+        # {product_id: {variation_key: CartItem}}
+        self.lines: Dict[str, Dict[VariationKey, CartItem]] = {}
+        self.shipping_fee = 0.0
+        # Shipping calculator version shipping_fee was computed with in this process (None = stale)
+        self.shipping_version: Optional[int] = None
+        # Merchant-supplied ID of the calculator a stored shipping_fee was computed with
+        self.shipping_calculator: Optional[str] = None
+        self.created_at = now
+        self.updated_at = now
+        # Version of the stored row this cart was read from (0 = not stored yet)
+        self.version = 0
+        # None until the first change since the last save
+        self.changed_lines: Optional[Dict[LineKey, None]] = None
+
+    def items(self) -> Iterator[CartItem]:
+        """Iterate over all lines"""
+        for product_lines in self.lines.values():
+            yield from product_lines.values()
+
+    def get_line(self, line_key: LineKey) -> Optional[CartItem]:
+        """Get a line by key, or None if the cart has no such line"""
+        product_lines = self.lines.get(line_key[0])
+        return product_lines.get(line_key[1]) if product_lines is not None else None
+
+    def add_line(self, item: CartItem) -> None:
+        """Add a new line (its key must not be in the cart yet)"""
+        self.lines.setdefault(item.product_id, {})[item.variations] = item
+        self._mark_line((item.product_id, item.variations))
+
+    def remove_line(self, line_key: LineKey) -> CartItem:
+        """Remove and return a line"""
+        product_lines = self.lines[line_key[0]]
+        item = product_lines.pop(line_key[1])
+        if not product_lines:
+            del self.lines[line_key[0]]
+        self._mark_line(line_key)
+        return item
+
+    def set_quantity(self, line_key: LineKey, quantity: int) -> None:
+        """Change the quantity of an existing line"""
+        self.lines[line_key[0]][line_key[1]].quantity = quantity
+        self._mark_line(line_key)
+
+    def _mark_line(self, line_key: LineKey) -> None:
+        if self.changed_lines is None:
+            self.changed_lines = {}
+        self.changed_lines[line_key] = None
+
+
+def encode_cart(cart: Cart) -> str:
+    """Serialize a cart to JSON (indexes and cached shipping are rebuilt on decode)"""
+    return json.dumps({
+        "session_id": cart.session_id,
+        "items": [item.to_dict() for item in cart.items()],
+        "created_at": cart.created_at,
+        "updated_at": cart.updated_at
+    })
+
+
+def decode_cart(data: str) -> Cart:
+    """Rebuild a cart from encode_cart output"""
+    record = json.loads(data)
+    cart = Cart(record["session_id"])
+    cart.created_at = record["created_at"]
+    cart.updated_at = record["updated_at"]
+
+    for item in record.get("items", []):
+        cart.add_line(CartItem.from_dict(item))
+
+    cart.changed_lines = None
+    return cart
+
+
+# ============================================================
+# Storage Backends
+# ============================================================
+
+class CartConflictError(Exception):
+    """Raised when a cart is saved after another worker changed the stored cart"""
+    pass
+
+
+class CartStorage(ABC):
+    """
+    Where CartService keeps carts, keyed by session_id.
+    Methods are async so backends doing I/O never block the event loop.
+    """
+
+    # Called with the session_id of each cart an in-process backend drops on
+    # its own (expiry or eviction), so the removal can be journaled
+    on_remove: Optional[Callable[[str], None]] = None
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Cart]:
+        """Get the cart for a session, or None if there is none"""
+        pass
+
+    @abstractmethod
+    async def put(self, session_id: str, cart: Cart) -> None:
+        """
+        Store the cart for a session (after every mutation).
+        Backends shared between processes raise CartConflictError if the
+        stored cart changed since `cart` was read.
+        """
+        pass
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> bool:
+        """Delete the cart for a session; returns True if it existed"""
+        pass
+
+    @abstractmethod
+    async def count(self) -> int:
+        """Number of stored carts"""
+        pass
+
+    @abstractmethod
+    def iter_carts(self) -> AsyncIterator[Cart]:
+        """Iterate over every stored cart, one at a time (used for snapshots)"""
+        pass
+
+    async def expire(self) -> int:
+        """Delete carts inactive for longer than the backend's ttl; returns how many were deleted"""
+        return 0
+
+    async def put_shipping(self, session_id: str, cart: Cart) -> None:
+        """
+        Store the shipping fee computed for an unchanged cart with the
+        calculator it was computed with (cart.shipping_calculator), for
+        backends that don't hold the cart object itself (skipped if the
+        cart changed).
+        """
+        pass
+
+    async def close(self) -> None:
+        """Release any resources held by the backend"""
+        pass
+
+
+class InMemoryCartStorage(CartStorage):
+    """
+    Keeps live cart objects in a dict; nothing is serialized.
+
+    Carts inactive for `ttl` seconds are removed by expire(), which pops
+    due deadlines off a min-heap instead of scanning every cart. At most
+    `max_carts` carts are kept; beyond that the least recently used cart
+    is evicted.
+    """
+
+    def __init__(self, ttl: float = 0, max_carts: int = 0):
+        """
+        Args:
+            ttl: Seconds of inactivity before a cart expires (0 never expires)
+            max_carts: Maximum live carts before LRU eviction (0 is unbounded)
+        """
+        self.ttl = ttl
+        self.max_carts = max_carts
+        # {session_id: cart_data}, least recently used first
+        self._carts: "OrderedDict[str, Cart]" = OrderedDict()
+        # Last activity per cart (monotonic seconds)
+        self._last_active: Dict[str, float] = {}
+        # Expiry min-heap of (deadline, session_id); entries whose deadline
+        # doesn't match _deadlines are stale and skipped
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        self.expirations = 0
+        self.evictions = 0
+
+    def _touch(self, session_id: str) -> None:
+        now = time.monotonic()
+        self._last_active[session_id] = now
+        self._carts.move_to_end(session_id)
+        if self.ttl > 0 and session_id not in self._deadlines:
+            self._schedule(session_id, now + self.ttl)
+
+    def _schedule(self, session_id: str, deadline: float) -> None:
+        self._deadlines[session_id] = deadline
+        heapq.heappush(self._expiry_heap, (deadline, session_id))
+
+    def _remove(self, session_id: str) -> Optional[Cart]:
+        self._last_active.pop(session_id, None)
+        self._deadlines.pop(session_id, None)
+        return self._carts.pop(session_id, None)
+
+    async def get(self, session_id: str) -> Optional[Cart]:
+        cart = self._carts.get(session_id)
+        if cart is not None:
+            self._touch(session_id)
+        return cart
+
+    async def put(self, session_id: str, cart: Cart) -> None:
+        self._carts[session_id] = cart
+        self._touch(session_id)
+
+        if self.max_carts > 0:
+            while len(self._carts) > self.max_carts:
+                evicted_id = next(iter(self._carts))
+                self._remove(evicted_id)
+                self.evictions += 1
+                logger.debug(f"Evicted least recently used cart {evicted_id}")
+                if self.on_remove is not None:
+                    self.on_remove(evicted_id)
+
+    async def delete(self, session_id: str) -> bool:
+        return self._remove(session_id) is not None
+
+    async def count(self) -> int:
+        return len(self._carts)
+
+    async def iter_carts(self) -> AsyncIterator[Cart]:
+        # Least recently used first, so putting carts back in order restores the LRU order
+        for session_id in list(self._carts):
+            cart = self._carts.get(session_id)
+            if cart is not None:
+                yield cart
+
+    async def expire(self) -> int:
+        if self.ttl <= 0:
+            return 0
+
+        now = time.monotonic()
+        expired = 0
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            deadline, session_id = heapq.heappop(self._expiry_heap)
+            if self._deadlines.get(session_id) != deadline:
+                continue
+
+            # Carts used since they were scheduled get a new deadline
+            next_deadline = self._last_active[session_id] + self.ttl
+            if next_deadline > now:
+                self._schedule(session_id, next_deadline)
+            else:
+                self._remove(session_id)
+                expired += 1
+                if self.on_remove is not None:
+                    self.on_remove(session_id)
+
+        self.expirations += expired
+        return expired
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cart count and expiry/eviction counters"""
+        return {
+            "carts": len(self._carts),
+            "max_carts": self.max_carts,
+            "ttl": self.ttl,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+class SqliteCartStorage(CartStorage):
+    """
+    Stores carts as JSON rows in a WAL-mode SQLite database, so several
+    worker processes can share carts without sticky sessions.
+    Queries run on one background thread, reusing the connection's cached
+    prepared statements.
+
+    Each row has a version that every write bumps. put() only writes if the
+    row still has the version the cart was read at (compare-and-swap), and
+    raises CartConflictError otherwise, so concurrent read-modify-writes
+    from two workers can't silently drop one of the updates. The shipping
+    fee computed for a row is stored with it, together with the ID of the
+    calculator that computed it, so unchanged carts don't call the same
+    shipping calculator again.
+    """
+
+    _GET = "SELECT data, version, shipping_fee, shipping_calculator FROM carts WHERE session_id = ?"
+    _INSERT = (
+        "INSERT OR IGNORE INTO carts (session_id, data, updated_at, shipping_fee, shipping_calculator, version) "
+        "VALUES (?, ?, ?, ?, ?, 1)"
+    )
+    _UPDATE = (
+        "UPDATE carts SET data = ?, updated_at = ?, shipping_fee = ?, shipping_calculator = ?, version = version + 1 "
+        "WHERE session_id = ? AND version = ?"
+    )
+    _PUT_SHIPPING = "UPDATE carts SET shipping_fee = ?, shipping_calculator = ? WHERE session_id = ? AND version = ?"
+    _DELETE = "DELETE FROM carts WHERE session_id = ?"
+    _COUNT = "SELECT COUNT(*) FROM carts"
+    _EXPIRE = "DELETE FROM carts WHERE updated_at < ?"
+    _PAGE = "SELECT rowid, data FROM carts WHERE rowid > ? ORDER BY rowid LIMIT ?"
+
+    def __init__(self, db_path: str, ttl: float = 0):
+        """
+        Args:
+            db_path: SQLite database file
+            ttl: Seconds without changes before a cart expires (0 never expires)
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        # One worker thread owns the connection, which also serializes writes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-cart")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._open).result()
+        logger.info(f"SqliteCartStorage initialized: {db_path}")
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=32)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Wait for other workers' write transactions instead of failing
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS carts ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "shipping_fee REAL NOT NULL DEFAULT 0, shipping_calculator TEXT, "
+            "version INTEGER NOT NULL DEFAULT 1)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_carts_updated_at ON carts (updated_at)")
+        self._conn.commit()
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a database function on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _db_get(self, session_id: str) -> Optional[Tuple[str, int, float, Optional[str]]]:
+        return self._conn.execute(self._GET, (session_id,)).fetchone()
+
+    def _db_put(
+        self,
+        session_id: str,
+        data: str,
+        updated_at: float,
+        shipping_fee: float,
+        shipping_calculator: Optional[str],
+        version: int
+    ) -> bool:
+        """Write the cart if the row is still at `version` (0 = no row yet); returns False on conflict"""
+        with self._conn:
+            if version == 0:
+                cursor = self._conn.execute(
+                    self._INSERT, (session_id, data, updated_at, shipping_fee, shipping_calculator)
+                )
+            else:
+                cursor = self._conn.execute(
+                    self._UPDATE, (data, updated_at, shipping_fee, shipping_calculator, session_id, version)
+                )
+            return cursor.rowcount > 0
+
+    def _db_put_shipping(self, session_id: str, shipping_fee: float, shipping_calculator: str, version: int) -> None:
+        with self._conn:
+            self._conn.execute(self._PUT_SHIPPING, (shipping_fee, shipping_calculator, session_id, version))
+
+    def _db_delete(self, session_id: str) -> bool:
+        with self._conn:
+            return self._conn.execute(self._DELETE, (session_id,)).rowcount > 0
+
+    def _db_count(self) -> int:
+        return self._conn.execute(self._COUNT).fetchone()[0]
+
+    def _db_expire(self, cutoff: float) -> int:
+        with self._conn:
+            return self._conn.execute(self._EXPIRE, (cutoff,)).rowcount
+
+    def _db_page(self, after_rowid: int, limit: int) -> List[Tuple[int, str]]:
+        return self._conn.execute(self._PAGE, (after_rowid, limit)).fetchall()
+
+    async def get(self, session_id: str) -> Optional[Cart]:
+        row = await self._run(self._db_get, session_id)
+        if row is None:
+            return None
+        cart = decode_cart(row[0])
+        cart.version, cart.shipping_fee, cart.shipping_calculator = row[1:]
+        return cart
+
+    async def put(self, session_id: str, cart: Cart) -> None:
+        stored = await self._run(
+            self._db_put, session_id, encode_cart(cart), cart.updated_at,
+            cart.shipping_fee, cart.shipping_calculator, cart.version
+        )
+        if not stored:
+            raise CartConflictError(f"Cart {session_id} was changed by another worker")
+        cart.version += 1
+
+    async def put_shipping(self, session_id: str, cart: Cart) -> None:
+        # The row's version only changes with its contents, so a stale fee can't overwrite a newer cart
+        await self._run(self._db_put_shipping, session_id, cart.shipping_fee, cart.shipping_calculator, cart.version)
+
+    async def delete(self, session_id: str) -> bool:
+        return await self._run(self._db_delete, session_id)
+
+    async def count(self) -> int:
+        return await self._run(self._db_count)
+
+    async def expire(self) -> int:
+        if self.ttl <= 0:
+            return 0
+        return await self._run(self._db_expire, time.time() - self.ttl)
+
+    async def iter_carts(self) -> AsyncIterator[Cart]:
+        # Page by rowid so only one page of rows is held at a time
+        after_rowid = 0
+        while True:
+            rows = await self._run(self._db_page, after_rowid, 500)
+            if not rows:
+                return
+            for after_rowid, data in rows:
+                yield decode_cart(data)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
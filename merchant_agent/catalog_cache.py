@@ -0,0 +1,308 @@
+"""
+Catalog Cache - In-memory product cache for merchant tools
+Sits in front of MerchantTools.get_products with TTL, LRU eviction,
+request coalescing and batched product ID lookups
+"""
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_PRODUCT_CACHE_TTL = 30.0
+DEFAULT_PRODUCT_CACHE_MAX_ENTRIES = 1000
+DEFAULT_PRODUCT_BATCH_WINDOW = 0.0
+DEFAULT_PRODUCT_BATCH_MAX_SIZE = 100
+DEFAULT_CATALOG_MAX_CONCURRENCY = 8
+DEFAULT_MISSING_PRODUCT_TTL = 5.0
+DEFAULT_MISSING_PRODUCT_MAX_ENTRIES = 1000
+
+# Sentinel for cache misses (cached values may legitimately be empty lists)
+MISSING = object()
+
+# Variation price table: {(type, name): price_modifier}
+VariationPrices = Dict[Tuple[str, str], float]
+
+# Priced line: (unit_price, product_name, product_image)
+Quote = Tuple[float, str, str]
+
+
+def normalize_filters(
+    query: str = "",
+    limit: int = 10,
+    product_id: Optional[str] = None,
+    name_contains: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    desc_contains: Optional[str] = None
+) -> Tuple:
+    """Build a hashable cache key from get_products filter arguments"""
+    def _text(value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return None
+        value = str(value).strip()
+        return value or None
+
+    def _number(value: Optional[float]) -> Optional[float]:
+        return None if value is None else float(value)
+
+    return (
+        "filters",
+        _text(query) or "",
+        int(limit),
+        _text(product_id),
+        _text(name_contains),
+        _number(price_min),
+        _number(price_max),
+        _text(desc_contains),
+    )
+
+
+def product_key(product_id: str) -> Tuple[str, str]:
+    """Cache key for a single product record"""
+    return ("product", str(product_id).strip())
+
+
+def build_variation_prices(product: Dict[str, Any]) -> VariationPrices:
+    """Map a product's (type, name) variations to price modifiers (first listed wins)"""
+    prices: VariationPrices = {}
+    for variation in product.get("variations") or []:
+        prices.setdefault((variation["type"], variation["name"]), variation["price_modifier"])
+    return prices
+
+
+class ProductCache:
+    """
+    TTL + LRU cache for product lookups.
+    Entries expire after `ttl` seconds; once `max_entries` is reached the
+    least recently used entry is evicted.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_PRODUCT_CACHE_TTL,
+        max_entries: int = DEFAULT_PRODUCT_CACHE_MAX_ENTRIES
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # {key: (expires_at, value)}, ordered from least to most recently used
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Cache is disabled when ttl or max_entries is not positive"""
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: Hashable) -> Any:
+        """Return cached value for key, or MISSING if absent or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value under key, evicting least recently used entries if full"""
+        if not self.enabled:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        """Drop one entry; returns True if it was cached"""
+        return self._entries.pop(key, None) is not None
+
+    def delete_matching(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches predicate; returns how many were dropped"""
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        """Drop all cached entries"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss/eviction counters"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests.
+    While a call for a key is in flight, later callers with the same key
+    await the same result instead of starting their own call.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run func for key, or join the call already in flight for key"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(func())
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so a cancelled caller doesn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, int]:
+        """Get call/coalesce counters"""
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
+
+
+class ProductLoader:
+    """
+    Batches product ID lookups across callers.
+    Distinct IDs requested within the same event-loop tick (or within
+    `window` seconds) are dispatched as one batch_fn call, and each caller
+    gets its own product back. Duplicate IDs share one future, both while
+    waiting for dispatch and while their batch is in flight, so at most one
+    catalog lookup per ID is running at a time.
+    
+    batch_fn maps IDs to products; an exception as an ID's value fails only
+    that ID's callers, so one bad ID doesn't fail unrelated lookups that
+    happened to share its batch. If batch_fn itself raises, the whole
+    batch fails.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+        window: float = DEFAULT_PRODUCT_BATCH_WINDOW,
+        max_batch_size: int = DEFAULT_PRODUCT_BATCH_MAX_SIZE
+    ):
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+        # Futures of dispatched IDs, until their batch resolves them
+        self._in_flight: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+        self._handle: Optional[asyncio.Handle] = None
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self.loads = 0
+        self.batches = 0
+
+    async def load(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """Get one product by ID (None if not found) via the next batch"""
+        self.loads += 1
+        future = self._pending.get(product_id) or self._in_flight.get(product_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[product_id] = future
+            if len(self._pending) >= self.max_batch_size:
+                self._dispatch()
+            elif self._handle is None:
+                if self.window > 0:
+                    self._handle = loop.call_later(self.window, self._dispatch)
+                else:
+                    self._handle = loop.call_soon(self._dispatch)
+        # Shield so a cancelled caller doesn't cancel the lookup for the rest of the batch
+        return await asyncio.shield(future)
+
+    async def load_many(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get several products by ID; unknown IDs are left out"""
+        unique_ids = list(dict.fromkeys(product_ids))
+        products = await asyncio.gather(*(self.load(product_id) for product_id in unique_ids))
+        return {
+            product_id: product
+            for product_id, product in zip(unique_ids, products)
+            if product is not None
+        }
+
+    def _dispatch(self) -> None:
+        """Send all pending IDs as one batch"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+
+        self._in_flight.update(batch)
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"]) -> None:
+        self.batches += 1
+        try:
+            found = await self.batch_fn(list(batch))
+        except Exception as e:
+            logger.debug(f"Product batch of {len(batch)} failed: {e}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        else:
+            for product_id, future in batch.items():
+                if future.done():
+                    continue
+                result = found.get(product_id)
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            for product_id, future in batch.items():
+                # Don't leave callers waiting if the batch was cancelled
+                if not future.done():
+                    future.cancel()
+                if self._in_flight.get(product_id) is future:
+                    del self._in_flight[product_id]
+
+    def stats(self) -> Dict[str, Any]:
+        """Get load/batch counters"""
+        return {
+            "pending": len(self._pending),
+            "in_flight": len(self._in_flight),
+            "window": self.window,
+            "max_batch_size": self.max_batch_size,
+            "loads": self.loads,
+            "batches": self.batches,
+        }
@@ -124,7 +124,7 @@ async def add_to_cart(
         Updated cart summary
     """
     try:
-        # Get session_id from global state
+        # Get session_id from the current session context
         session_id = get_session_id()
         merchant_tools = get_merchant_tools()
         logger.info(f"Calculating price for {product_id} using calculate_total")
@@ -144,16 +144,22 @@ async def add_to_cart(
             order_item = calc_result["items"][0]
             unit_price = float(order_item.get("unit_price"))
             product_name = order_item.get("product_name", "")
+            # Hand the priced product through so the cart doesn't look it up again
+            product = {
+                "name": product_name,
+                "image": order_item.get("product_image", ""),
+            }
             logger.info(f"Calculated unit_price for {product_id}: ${unit_price}")
         else:
             logger.warning(f"No items returned from price calculation")
             unit_price = 0.0
             product_name = ""
+            product = None
         
         cart_service = get_cart_service()
         logger.info(f"Adding to cart: {product_id} x{quantity} @ ${unit_price}")
         
-        result = await cart_service.add_to_cart(session_id, product_id, quantity, variations, unit_price)
+        result = await cart_service.add_to_cart(session_id, product_id, quantity, variations, unit_price, product)
         
         if tool_context:
             tool_context.state["cart_result"] = result
@@ -170,6 +176,74 @@ async def add_to_cart(
         return error_msg
 
 
+async def add_items_to_cart(
+    items: List[Dict[str, Any]],
+    tool_context: ToolContext = None,
+) -> str:
+    """
+    Add several items to shopping cart at once
+    
+    Args:
+        items: List of items to add, each with:
+               - product_id (str): Product ID
+               - quantity (int): Quantity to add (must be > 0)
+               - variations (list[dict], optional): Selected variations with type and name
+        tool_context: Tool execution context
+        
+    Returns:
+        Updated cart summary
+    """
+    try:
+        # Get session_id from the current session context
+        session_id = get_session_id()
+        merchant_tools = get_merchant_tools()
+        logger.info(f"Calculating prices for {len(items)} item(s) using calculate_total")
+        
+        # Price every line in one batch
+        calc_result = await merchant_tools.calculate_total(
+            items=[{
+                "product_id": item["product_id"],
+                "quantity": item["quantity"],
+                "variations": item.get("variations") or []
+            } for item in items]
+        )
+        
+        cart_items = [
+            {
+                "product_id": priced["product_id"],
+                "quantity": priced["quantity"],
+                "variations": priced.get("variations") or [],
+                "unit_price": float(priced["unit_price"]),
+                # Hand the priced product through so the cart doesn't look it up again
+                "product": {
+                    "name": priced.get("product_name", ""),
+                    "image": priced.get("product_image", ""),
+                },
+            }
+            for priced in calc_result["items"]
+        ]
+        
+        cart_service = get_cart_service()
+        logger.info(f"Adding {len(cart_items)} item(s) to cart")
+        
+        result = await cart_service.add_many(session_id, cart_items)
+        
+        if tool_context:
+            tool_context.state["cart_result"] = result
+        
+        added = ", ".join(f"{item['quantity']} x {item['product']['name']}" for item in cart_items)
+        item_count = result.get('item_count', 0)
+        total = result.get('total_amount', 0)
+        return f"Added {added} to cart. Cart now has {item_count} item(s), total: ${total:.2f}"
+
+    except Exception as e:
+        logger.error(f"Add items to cart error: {e}", exc_info=True)
+        error_msg = f"Failed to add items to cart: {str(e)}"
+        if tool_context:
+            tool_context.state["cart_result"] = error_msg
+        return error_msg
+
+
 async def view_cart(
     tool_context: ToolContext = None,
 ) -> str:
@@ -183,13 +257,13 @@ async def view_cart(
         Cart contents with all items, amounts, and totals
     """
     try:
-        # Get session_id from global state
+        # Get session_id from the current session context
         session_id = get_session_id()
         
         cart_service = get_cart_service()
         logger.info(f"Viewing cart for session {session_id}")
         
-        result = cart_service.view_cart(session_id)
+        result = await cart_service.view_cart(session_id)
         
         if tool_context:
             tool_context.state["cart_result"] = result
@@ -204,6 +278,7 @@ async def view_cart(
             "item_count": result["item_count"],
             "subtotal": result.get("subtotal", 0),
             "shipping_fee": result.get("shipping_fee", 0),
+            "shipping_estimated": result.get("shipping_estimated", False),
             "total_amount": result.get("total_amount", 0),
             "updated_at": result["updated_at"]
         }
@@ -235,20 +310,20 @@ async def remove_from_cart(
         Updated cart summary
     """
     try:
-        # Get session_id from global state
+        # Get session_id from the current session context
         session_id = get_session_id()
         
         cart_service = get_cart_service()
         logger.info(f"Removing from cart: {product_id} (session: {session_id})")
         
-        cart_before = cart_service.view_cart(session_id)
+        cart_before = await cart_service.view_cart(session_id)
         product_name = product_id
         for item in cart_before.get("items", []):
             if item["product_id"] == product_id:
                 product_name = item.get("product_name", product_id)
                 break
         
-        result = cart_service.remove_from_cart(session_id, product_id, variations)
+        result = await cart_service.remove_from_cart(session_id, product_id, variations)
         
         if tool_context:
             tool_context.state["cart_result"] = result
@@ -4,7 +4,7 @@ Handles all settings needed to initialize and run the agent
 """
 
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import List, Optional
 
 
 @dataclass
@@ -43,12 +43,81 @@ class MerchantAgentConfig:
     session_timeout: int = 3600
     """Session timeout in seconds (default: 1 hour)"""
     
+    max_sessions: int = 1000
+    """Maximum concurrently open sessions per MerchantAgent"""
+    
+    session_db_path: Optional[str] = None
+    """SQLite file for persistent sessions (None keeps sessions in memory);
+    sessions inactive for session_timeout are purged"""
+    
+    session_purge_interval: float = 300.0
+    """Seconds between purges of expired persistent sessions"""
+    
     enable_debug: bool = False
     """Enable debug logging for troubleshooting"""
     
     custom_instruction: Optional[str] = None
     """Custom system instruction for the agent (overrides default)"""
     
+    share_runner: bool = False
+    """Build the agent tree and Runner once per process and share them across
+    MerchantAgent instances with the same model, app name and instructions;
+    each instance then only creates its own session"""
+    
+    cart_db_path: Optional[str] = None
+    """SQLite file for carts shared between worker processes (None keeps carts in memory)"""
+    
+    max_carts: int = 100000
+    """Maximum in-memory carts before least recently used are evicted (0 = unbounded);
+    carts also expire after session_timeout of inactivity"""
+    
+    cart_sweep_interval: float = 60.0
+    """Seconds between sweeps for expired carts"""
+    
+    cart_snapshot_path: Optional[str] = None
+    """File in-memory carts are saved to on shutdown and restored from on startup (None disables)"""
+    
+    cart_journal_path: Optional[str] = None
+    """Append-only journal of cart changes for crash safety (requires cart_snapshot_path,
+    which the journal is compacted into)"""
+    
+    cart_journal_flush_interval: float = 0.005
+    """Seconds to group journaled cart changes into one write and fsync"""
+    
+    cart_compact_interval: float = 300.0
+    """Seconds between compactions of the cart journal into the snapshot"""
+    
+    product_cache_ttl: float = 30.0
+    """Seconds a cached product lookup stays valid (0 disables the product cache)"""
+    
+    product_cache_max_entries: int = 1000
+    """Maximum cached product lookups before least recently used are evicted"""
+    
+    product_batch_window: float = 0.0
+    """Seconds to collect product ID lookups into one batch (0 = same event-loop tick)"""
+    
+    product_batch_max_size: int = 100
+    """Maximum product IDs per batched catalog lookup"""
+    
+    catalog_max_concurrency: int = 8
+    """Maximum get_products calls the product cache makes at once"""
+    
+    missing_product_cache_ttl: float = 5.0
+    """Seconds a product ID the catalog didn't find is remembered as missing (0 disables)"""
+    
+    missing_product_cache_max_entries: int = 1000
+    """Maximum remembered missing product IDs before least recently used are evicted"""
+    
+    catalog_warmup_ids: Optional[List[str]] = None
+    """Product IDs to prefetch into the product cache during initialize()"""
+    
+    catalog_warmup_top_n: int = 0
+    """Also prefetch the first N products get_products returns for an empty query (0 = none)"""
+    
+    catalog_warmup_background: bool = False
+    """Warm the catalog in the background instead of before initialize() returns;
+    check MerchantAgent.is_catalog_ready() for completion"""
+    
     def validate(self) -> bool:
         """Validate configuration has required fields"""
         if not self.api_key:
@@ -59,6 +128,12 @@ class MerchantAgentConfig:
             raise ValueError("user_id is required")
         if not self.model:
             raise ValueError("model is required")
+        if self.max_sessions <= 0:
+            raise ValueError("max_sessions must be greater than 0")
+        if self.max_carts < 0:
+            raise ValueError("max_carts cannot be negative")
+        if self.cart_journal_path and not self.cart_snapshot_path:
+            raise ValueError("cart_journal_path requires cart_snapshot_path")
         return True
     
     def to_dict(self) -> dict:
@@ -71,7 +146,28 @@ class MerchantAgentConfig:
             "session_id": self.session_id,
             "log_level": self.log_level,
             "session_timeout": self.session_timeout,
+            "max_sessions": self.max_sessions,
+            "session_db_path": self.session_db_path,
+            "session_purge_interval": self.session_purge_interval,
             "enable_debug": self.enable_debug,
             "custom_instruction": self.custom_instruction,
+            "share_runner": self.share_runner,
             "payment_agent_card_url": self.payment_agent_card_url,
+            "cart_db_path": self.cart_db_path,
+            "max_carts": self.max_carts,
+            "cart_sweep_interval": self.cart_sweep_interval,
+            "cart_snapshot_path": self.cart_snapshot_path,
+            "cart_journal_path": self.cart_journal_path,
+            "cart_journal_flush_interval": self.cart_journal_flush_interval,
+            "cart_compact_interval": self.cart_compact_interval,
+            "product_cache_ttl": self.product_cache_ttl,
+            "product_cache_max_entries": self.product_cache_max_entries,
+            "product_batch_window": self.product_batch_window,
+            "product_batch_max_size": self.product_batch_max_size,
+            "catalog_max_concurrency": self.catalog_max_concurrency,
+            "missing_product_cache_ttl": self.missing_product_cache_ttl,
+            "missing_product_cache_max_entries": self.missing_product_cache_max_entries,
+            "catalog_warmup_ids": self.catalog_warmup_ids,
+            "catalog_warmup_top_n": self.catalog_warmup_top_n,
+            "catalog_warmup_background": self.catalog_warmup_background,
         }
\ No newline at end of file
@@ -6,10 +6,13 @@ import asyncio
 import logging
 import time
 import os
+import uuid
 import json
-from typing import Optional
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Set, Tuple
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
+from google.adk.sessions import BaseSessionService, InMemorySessionService
 from google.genai import types
 
 # Import internal modules
@@ -17,9 +20,175 @@ from .config import MerchantAgentConfig
 from .tools import MerchantTools, set_merchant_tools, get_merchant_tools
 from .agent.llm_agent import create_merchant_agent
 from .session import set_session_id, get_session_id
+from .session_service import SqliteSessionService
+from .cart_journal import CartJournal
+from .cart_service import get_cart_service
+from .cart_storage import InMemoryCartStorage, SqliteCartStorage
 
 logger = logging.getLogger(__name__)
 
+# Agent graphs and runners shared across MerchantAgent instances (config.share_runner)
+_shared_runners: Dict[Tuple, Tuple[Runner, BaseSessionService]] = {}
+# Number of initialized MerchantAgents using each shared runner
+_shared_runner_users: Dict[Tuple, int] = {}
+
+
+def _create_session_service(config: MerchantAgentConfig) -> BaseSessionService:
+    """Create the session service selected by config"""
+    if config.session_db_path:
+        return SqliteSessionService(config.session_db_path, ttl=config.session_timeout)
+    return InMemorySessionService()
+
+
+def _build_runner(config: MerchantAgentConfig, session_service: BaseSessionService) -> Runner:
+    """Build the agent tree and a Runner for it"""
+    return Runner(
+        agent=create_merchant_agent(config.model, config.app_name, config.custom_instruction, config.payment_agent_card_url),
+        app_name=config.app_name,
+        session_service=session_service
+    )
+
+
+def _shared_runner_key(config: MerchantAgentConfig) -> Tuple:
+    return (config.model, config.app_name, config.custom_instruction, config.payment_agent_card_url, config.session_db_path)
+
+
+def _get_shared_runner(config: MerchantAgentConfig) -> Tuple[Runner, BaseSessionService]:
+    """Get the process-wide runner and session service for this agent setup, building it once"""
+    key = _shared_runner_key(config)
+    if key not in _shared_runners:
+        session_service = _create_session_service(config)
+        _shared_runners[key] = (_build_runner(config, session_service), session_service)
+        logger.info(f"Shared runner created for app: {config.app_name}")
+    _shared_runner_users[key] = _shared_runner_users.get(key, 0) + 1
+    return _shared_runners[key]
+
+
+async def _release_shared_runner(config: MerchantAgentConfig) -> None:
+    """Drop one user of a shared runner; the last user closes its session service"""
+    key = _shared_runner_key(config)
+    users = _shared_runner_users.get(key, 0) - 1
+    if users > 0:
+        _shared_runner_users[key] = users
+        # Other agents keep using the service, but don't leave this agent's events queued
+        session_service = _shared_runners[key][1]
+        if isinstance(session_service, SqliteSessionService):
+            await session_service.flush()
+        return
+    
+    _shared_runner_users.pop(key, None)
+    _, session_service = _shared_runners.pop(key)
+    if isinstance(session_service, SqliteSessionService):
+        await session_service.close()
+    logger.info(f"Shared runner released for app: {config.app_name}")
+
+
+# Settings the global cart service's storage was configured with
+_cart_storage_settings: Optional[Tuple] = None
+
+
+async def _configure_cart_storage(config: MerchantAgentConfig) -> None:
+    """
+    Set up the global cart service's storage, keeping it if already configured the same way.
+    
+    Raises:
+        ValueError: If running agents use storage configured differently
+    """
+    global _cart_storage_settings
+    settings = (config.cart_db_path, config.session_timeout, config.max_carts)
+    if settings == _cart_storage_settings:
+        return
+    if _cart_service_users > 0:
+        raise ValueError(
+            "Cart storage is already in use with different settings "
+            "(cart_db_path, session_timeout, max_carts must match across agents)"
+        )
+    
+    cart_service = get_cart_service()
+    await cart_service.storage.close()
+    if config.cart_db_path:
+        storage = SqliteCartStorage(config.cart_db_path, ttl=config.session_timeout)
+    else:
+        storage = InMemoryCartStorage(ttl=config.session_timeout, max_carts=config.max_carts)
+    cart_service.set_storage(storage)
+    _cart_storage_settings = settings
+
+
+# Cart snapshots already restored in this process
+_restored_cart_snapshots: Set[str] = set()
+
+# Number of initialized MerchantAgents using the global cart service's background tasks and storage
+_cart_service_users = 0
+
+
+async def _acquire_cart_service(config: MerchantAgentConfig) -> None:
+    """Register an agent as a user of the global cart service, starting its background work once"""
+    global _cart_service_users
+    # Storage is built by the first user (and rebuilt if the last user closed it)
+    await _configure_cart_storage(config)
+    _cart_service_users += 1
+    cart_service = get_cart_service()
+    
+    # Bring back carts saved by the previous process (once, until the last agent shuts down)
+    snapshot_path = config.cart_snapshot_path
+    if snapshot_path and not config.cart_db_path and snapshot_path not in _restored_cart_snapshots:
+        _restored_cart_snapshots.add(snapshot_path)
+        if config.cart_journal_path:
+            cart_service.set_journal(CartJournal(
+                config.cart_journal_path,
+                flush_interval=config.cart_journal_flush_interval
+            ))
+        try:
+            await cart_service.recover(snapshot_path, max_age=config.session_timeout)
+        except Exception as e:
+            logger.error(f"Could not restore carts from {snapshot_path}: {e}")
+        if cart_service.journal is not None:
+            cart_service.start_compactor(snapshot_path, config.cart_compact_interval)
+    
+    # Expire inactive carts in the background
+    cart_service.start_sweeper(config.cart_sweep_interval)
+
+
+async def _release_cart_service(config: MerchantAgentConfig) -> None:
+    """
+    Drop one user of the global cart service. The last user stops its
+    background tasks and closes persistent cart storage (or snapshots
+    in-memory carts if cart_snapshot_path is set, compacting and closing
+    the cart journal).
+    """
+    global _cart_service_users, _cart_storage_settings
+    _cart_service_users -= 1
+    if _cart_service_users > 0:
+        return
+    
+    cart_service = get_cart_service()
+    await cart_service.stop_sweeper()
+    if config.cart_db_path:
+        await cart_service.storage.close()
+        # The next agent opens the database again
+        _cart_storage_settings = None
+    elif config.cart_snapshot_path:
+        await cart_service.stop_compactor()
+        await cart_service.compact(config.cart_snapshot_path)
+        if cart_service.journal is not None:
+            await cart_service.journal.close()
+            cart_service.set_journal(None)
+        # The next agent reopens the journal on top of this snapshot
+        _restored_cart_snapshots.discard(config.cart_snapshot_path)
+
+
+@dataclass
+class SessionInfo:
+    """Stats for one pooled conversation session"""
+    session_id: str
+    user_id: str
+    created_at: float
+    last_active: float
+    message_count: int = 0
+    tool_call_count: int = 0
+    active_streams: int = 0
+
+
 class MerchantAgent:
     def __init__(
         self,
@@ -40,8 +209,17 @@ class MerchantAgent:
         self.merchant_tools = merchant_tools
         self.session_id: Optional[str] = None
         self.runner: Optional[Runner] = None
-        self.session_service: Optional[InMemorySessionService] = None
+        self.session_service: Optional[BaseSessionService] = None
         self.model = config.model
+        # Open sessions, least recently active first: {session_id: SessionInfo}
+        self._sessions: "OrderedDict[str, SessionInfo]" = OrderedDict()
+        # Opens in progress, so concurrent opens of one session share a single lookup
+        self._opening: Dict[str, "asyncio.Future[SessionInfo]"] = {}
+        # Background catalog warm-up, if configured
+        self._warmup_task: Optional["asyncio.Task[int]"] = None
+        # Whether this agent holds a reference to a shared runner / the global cart service
+        self._holds_shared_runner = False
+        self._holds_cart_service = False
 
         # Set API key in environment for ADK/GenAI usage
         os.environ["GOOGLE_API_KEY"] = self.config.api_key
@@ -49,6 +227,21 @@ class MerchantAgent:
         # Set up logging
         self._setup_logging()
         
+        # Put the product cache in front of the merchant's get_products
+        merchant_tools.configure_product_cache(
+            ttl=config.product_cache_ttl,
+            max_entries=config.product_cache_max_entries
+        )
+        merchant_tools.configure_product_loader(
+            window=config.product_batch_window,
+            max_batch_size=config.product_batch_max_size
+        )
+        merchant_tools.configure_catalog_concurrency(config.catalog_max_concurrency)
+        merchant_tools.configure_missing_product_cache(
+            ttl=config.missing_product_cache_ttl,
+            max_entries=config.missing_product_cache_max_entries
+        )
+        
         # Set the merchant tools globally so they're available to the agent
         set_merchant_tools(merchant_tools)
         
@@ -70,41 +263,253 @@ class MerchantAgent:
         Must be called before running the agent.
         """
         # Generate session ID if not provided
+        # (suffixed so sessions created in the same second don't collide in a shared session service)
         if not self.config.session_id:
-            self.config.session_id = f"{self.config.user_id}_{int(time.time())}"
+            self.config.session_id = self._new_session_id(self.config.user_id)
         
         self.session_id = self.config.session_id
         set_session_id(self.session_id)
         
-        # Create session service
-        self.session_service = InMemorySessionService()
-        await self.session_service.create_session(
+        # Set up cart storage with expiry after session_timeout (in a shared database if
+        # configured), restore carts and start cart expiry; shared by every agent in the process
+        if not self._holds_cart_service:
+            await _acquire_cart_service(self.config)
+            self._holds_cart_service = True
+        
+        # Create session service and runner (or reuse the shared ones)
+        if self.config.share_runner:
+            if not self._holds_shared_runner:
+                self.runner, self.session_service = _get_shared_runner(self.config)
+                self._holds_shared_runner = True
+        else:
+            self.session_service = _create_session_service(self.config)
+            self.runner = _build_runner(self.config, self.session_service)
+        
+        # Drop persisted sessions that expired while the process was down, and keep purging them
+        if isinstance(self.session_service, SqliteSessionService):
+            await self.session_service.purge_expired()
+            self.session_service.start_purger(self.config.session_purge_interval)
+        
+        await self.open_session(self.session_id, self.config.user_id)
+        
+        # Prefetch products so the first shoppers after a deploy don't hit a cold cache
+        if self._wants_warmup() and not self.merchant_tools.catalog_ready:
+            warmup = self.merchant_tools.warm_catalog(
+                product_ids=self.config.catalog_warmup_ids,
+                top_n=self.config.catalog_warmup_top_n
+            )
+            if self.config.catalog_warmup_background:
+                self._warmup_task = asyncio.ensure_future(warmup)
+            else:
+                await warmup
+        
+        logger.info(f"Agent initialized. Session: {self.session_id}")
+    
+    # ========== Session Pool ==========
+    
+    def _new_session_id(self, user_id: str) -> str:
+        """Generate a unique session ID for a user"""
+        return f"{user_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    
+    async def open_session(
+        self,
+        session_id: Optional[str] = None,
+        user_id: Optional[str] = None
+    ) -> str:
+        """
+        Open a pooled conversation session on this agent.
+        Resumes the session if the session service already has it (e.g. a
+        persisted session from before a restart), otherwise creates it.
+        
+        Args:
+            session_id: Session ID to open (generated if None)
+            user_id: Owner of the session (defaults to config.user_id)
+            
+        Returns:
+            The session ID
+        """
+        if not self.runner:
+            await self.initialize()
+        
+        user_id = user_id or self.config.user_id
+        session_id = session_id or self._new_session_id(user_id)
+        
+        if session_id not in self._sessions and session_id not in self._opening:
+            # Make room by dropping idle sessions before enforcing the limit
+            await self.evict_idle_sessions()
+        
+        info = self._sessions.get(session_id)
+        if info is None:
+            opening = self._opening.get(session_id)
+            if opening is None:
+                # Reserve the pool slot before awaiting the session service, so
+                # concurrent opens can't overshoot the limit
+                if len(self._sessions) + len(self._opening) >= self.config.max_sessions:
+                    raise RuntimeError(f"Session limit reached ({self.config.max_sessions} open sessions)")
+                opening = asyncio.ensure_future(self._load_session(session_id, user_id))
+                self._opening[session_id] = opening
+                opening.add_done_callback(lambda _: self._opening.pop(session_id, None))
+            # Concurrent first messages for a session share one open; shield so a
+            # cancelled caller doesn't cancel it for the others
+            info = await asyncio.shield(opening)
+        
+        if info.user_id != user_id:
+            raise ValueError(f"Session {session_id} belongs to another user")
+        return session_id
+    
+    async def _load_session(self, session_id: str, user_id: str) -> SessionInfo:
+        """Resume or create a session and add it to the pool"""
+        session = await self.session_service.get_session(
             app_name=self.config.app_name,
-            user_id=self.config.user_id,
-            session_id=self.session_id
+            user_id=user_id,
+            session_id=session_id
         )
+        resumed = session is not None
+        if session is None:
+            session = await self.session_service.create_session(
+                app_name=self.config.app_name,
+                user_id=user_id,
+                session_id=session_id
+            )
         
-        # Create runner
-        self.runner = Runner(
-            agent=create_merchant_agent(self.model, self.config.app_name, self.config.custom_instruction, self.config.payment_agent_card_url),
+        # Rebuild the pool entry from the session's history
+        now = time.time()
+        events = session.events or []
+        info = SessionInfo(
+            session_id=session.id,
+            user_id=session.user_id,
+            created_at=now,
+            last_active=now,
+            message_count=sum(1 for event in events if event.author == "user"),
+            tool_call_count=sum(len(event.get_function_calls()) for event in events)
+        )
+        self._sessions[session.id] = info
+        logger.info(
+            f"Session {'resumed' if resumed else 'opened'}: {session.id} ({len(self._sessions)} open)"
+        )
+        return info
+    
+    async def close_session(self, session_id: str) -> bool:
+        """
+        Close a pooled session and drop its conversation history.
+        
+        Args:
+            session_id: Session ID to close
+            
+        Returns:
+            True if the session was open
+        """
+        info = self._sessions.pop(session_id, None)
+        if info is None:
+            return False
+        
+        await self.session_service.delete_session(
             app_name=self.config.app_name,
-            session_service=self.session_service
+            user_id=info.user_id,
+            session_id=session_id
         )
+        logger.info(f"Session closed: {session_id} ({len(self._sessions)} open)")
+        return True
+    
+    async def evict_idle_sessions(self) -> int:
+        """
+        Close sessions idle for longer than config.session_timeout.
+        Sessions with a stream in progress are kept.
         
-        logger.info(f"Agent initialized. Session: {self.session_id}")
+        Returns:
+            Number of sessions closed
+        """
+        if self.config.session_timeout <= 0:
+            return 0
+        
+        cutoff = time.time() - self.config.session_timeout
+        idle: List[str] = []
+        # Sessions are ordered by last activity, so stop at the first recent one
+        for info in self._sessions.values():
+            if info.last_active > cutoff:
+                break
+            if info.active_streams == 0:
+                idle.append(info.session_id)
+        
+        for session_id in idle:
+            await self.close_session(session_id)
+        
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle session(s)")
+        return len(idle)
+    
+    def get_session_stats(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Get stats for one pooled session, or for the whole pool.
+        
+        Args:
+            session_id: Session to report on (None for all sessions)
+            
+        Returns:
+            Session stats dict
+        """
+        if session_id is not None:
+            info = self._sessions.get(session_id)
+            return asdict(info) if info else {}
+        
+        return {
+            "open_sessions": len(self._sessions),
+            "max_sessions": self.config.max_sessions,
+            "sessions": [asdict(info) for info in self._sessions.values()],
+        }
     
-    async def query_stream(self, user_input: str):
+    async def query_stream(
+        self,
+        user_input: str,
+        session_id: Optional[str] = None,
+        user_id: Optional[str] = None
+    ):
+        """
+        Stream the agent's response to a user message.
+        
+        Args:
+            user_input: The user's message
+            session_id: Pooled session to use (defaults to the agent's own session);
+                        unknown sessions are opened automatically
+            user_id: Owner of the session (defaults to config.user_id)
+        """
         if not self.runner:
             await self.initialize()
 
+        session_id = session_id or self.session_id
+        info = self._sessions.get(session_id)
+        if info is None or (user_id and info.user_id != user_id):
+            await self.open_session(session_id, user_id)
+            info = self._sessions[session_id]
+
+        self._sessions.move_to_end(session_id)
+        info.last_active = time.time()
+        info.message_count += 1
+        info.active_streams += 1
+
+        # Session ID lives in a context variable, so each stream's tools see their own cart
+        set_session_id(session_id)
+
+        try:
+            async for chunk in self._stream_events(user_input, info):
+                yield chunk
+        finally:
+            info.active_streams -= 1
+            info.last_active = time.time()
+            # Keep the pool ordered by last_active, which evict_idle_sessions relies on
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+
+    async def _stream_events(self, user_input: str, info: SessionInfo):
+        """Run one user message through the runner and convert events to stream chunks"""
         content = types.Content(
             role="user",
             parts=[types.Part(text=user_input)]
         )
 
         async for event in self.runner.run_async(
-            user_id=self.config.user_id,
-            session_id=self.session_id,
+            user_id=info.user_id,
+            session_id=info.session_id,
             new_message=content
         ):
             # Tool call initiation
@@ -112,6 +517,7 @@ class MerchantAgent:
                 function_calls = event.get_function_calls()
                 if function_calls:
                     for call in function_calls:
+                        info.tool_call_count += 1
                         logger.info(f"Tool call initiated: {call.name}")
                         yield {
                             "type": "tool_call",
@@ -167,6 +573,40 @@ class MerchantAgent:
             if event.is_final_response():
                 return
     
+    async def shutdown(self) -> None:
+        """
+        Release the agent's resources on graceful shutdown.
+        Flushes and closes a persistent session service (a shared one once
+        its last agent shuts down); this agent's sessions are deleted from a
+        shared in-memory session service. Once the last agent in the process shuts
+        down, closes persistent cart storage (or snapshots in-memory carts if
+        cart_snapshot_path is set, compacting and closing the cart journal).
+        """
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        if self._holds_shared_runner:
+            if isinstance(self.session_service, InMemorySessionService):
+                # Other agents keep the shared service alive, so drop this agent's sessions from it
+                if self._opening:
+                    await asyncio.gather(*self._opening.values(), return_exceptions=True)
+                for session_id in list(self._sessions):
+                    await self.close_session(session_id)
+            await _release_shared_runner(self.config)
+            self._holds_shared_runner = False
+        elif isinstance(self.session_service, SqliteSessionService):
+            await self.session_service.close()
+        if self._holds_cart_service:
+            await _release_cart_service(self.config)
+            self._holds_cart_service = False
+        logger.info("MerchantAgent shut down")
+    
+    def _wants_warmup(self) -> bool:
+        return bool(self.config.catalog_warmup_ids) or self.config.catalog_warmup_top_n > 0
+    
+    def is_catalog_ready(self) -> bool:
+        """True once catalog warm-up has finished (always True if warm-up isn't configured)"""
+        return self.merchant_tools.catalog_ready or not self._wants_warmup()
+    
     def get_session_id(self) -> str:
         """Get the current session ID"""
         return self.session_id or "Not initialized"
@@ -1,12 +1,13 @@
+from contextvars import ContextVar
 from typing import Optional
 
-_current_session_id: Optional[str] = None
+# Per-context session ID, so concurrent sessions in one event loop don't share it
+_current_session_id: ContextVar[Optional[str]] = ContextVar("current_session_id", default=None)
 
 def set_session_id(session_id: str) -> None:
     """Set the current session ID for tools to access"""
-    global _current_session_id
-    _current_session_id = session_id
+    _current_session_id.set(session_id)
 
 def get_session_id() -> str:
     """Get the current session ID"""
-    return _current_session_id or "default_session"
+    return _current_session_id.get() or "default_session"
@@ -0,0 +1,477 @@
+"""
+SQLite Session Service - Persistent drop-in for ADK's InMemorySessionService
+Stores sessions and events in a WAL-mode SQLite database with batched event appends
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import Session
+from google.adk.sessions.base_session_service import (
+    BaseSessionService,
+    GetSessionConfig,
+    ListSessionsResponse,
+)
+from google.adk.sessions.state import State
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    create_time REAL NOT NULL,
+    update_time REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, session_id)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_update_time ON sessions (update_time);
+
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_session ON events (app_name, user_id, session_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS app_states (
+    app_name TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_states (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (app_name, user_id)
+);
+"""
+
+# (app_name, user_id, session_id)
+SessionKey = Tuple[str, str, str]
+
+
+def _split_state(state: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """Split state into (app, user, session) scopes, dropping temp: keys"""
+    app_state: Dict[str, Any] = {}
+    user_state: Dict[str, Any] = {}
+    session_state: Dict[str, Any] = {}
+    for key, value in state.items():
+        if key.startswith(State.APP_PREFIX):
+            app_state[key] = value
+        elif key.startswith(State.USER_PREFIX):
+            user_state[key] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            session_state[key] = value
+    return app_state, user_state, session_state
+
+
+class SqliteSessionService(BaseSessionService):
+    """
+    Session service backed by SQLite in WAL mode.
+
+    Events are applied to the in-memory session right away and written to
+    the database in batches (every `flush_interval` seconds or `batch_size`
+    events), so appending an event on the query_stream hot path doesn't wait
+    on disk. Pending events are flushed before any read. All database work
+    runs on one background thread so it never blocks the event loop.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        ttl: float = 0,
+        flush_interval: float = 0.05,
+        batch_size: int = 100
+    ):
+        """
+        Args:
+            db_path: SQLite database file
+            ttl: Seconds of inactivity after which purge_expired() deletes a session (0 keeps sessions forever)
+            flush_interval: Seconds to collect appended events before writing them
+            batch_size: Pending events that trigger an immediate write
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+
+        # One worker thread owns the connection, which also serializes writes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-session")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._open).result()
+
+        # Queued event writes: (session key, event row, state deltas by scope)
+        self._pending: List[Tuple[SessionKey, Tuple[float, str], Tuple[Dict, Dict, Dict]]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional["asyncio.Task[None]"] = None
+        # Background task purging expired sessions
+        self._purger: Optional["asyncio.Task[None]"] = None
+        logger.info(f"SqliteSessionService initialized: {db_path}")
+
+    # ========== Database Thread ==========
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a database function on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _load_scoped_state(self, app_name: str, user_id: str) -> Dict[str, Any]:
+        state: Dict[str, Any] = {}
+        row = self._conn.execute(
+            "SELECT state FROM app_states WHERE app_name = ?", (app_name,)
+        ).fetchone()
+        if row:
+            state.update(json.loads(row[0]))
+        row = self._conn.execute(
+            "SELECT state FROM user_states WHERE app_name = ? AND user_id = ?", (app_name, user_id)
+        ).fetchone()
+        if row:
+            state.update(json.loads(row[0]))
+        return state
+
+    def _merge_scoped_state(self, app_name: str, user_id: str, app_delta: Dict, user_delta: Dict) -> None:
+        if app_delta:
+            row = self._conn.execute(
+                "SELECT state FROM app_states WHERE app_name = ?", (app_name,)
+            ).fetchone()
+            state = json.loads(row[0]) if row else {}
+            state.update(app_delta)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO app_states (app_name, state) VALUES (?, ?)",
+                (app_name, json.dumps(state))
+            )
+        if user_delta:
+            row = self._conn.execute(
+                "SELECT state FROM user_states WHERE app_name = ? AND user_id = ?", (app_name, user_id)
+            ).fetchone()
+            state = json.loads(row[0]) if row else {}
+            state.update(user_delta)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO user_states (app_name, user_id, state) VALUES (?, ?, ?)",
+                (app_name, user_id, json.dumps(state))
+            )
+
+    def _db_create_session(self, key: SessionKey, state: Dict[str, Any], now: float) -> Optional[Dict[str, Any]]:
+        app_name, user_id, session_id = key
+        app_state, user_state, session_state = _split_state(state)
+        try:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO sessions (app_name, user_id, session_id, state, create_time, update_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (app_name, user_id, session_id, json.dumps(session_state), now, now)
+                )
+                self._merge_scoped_state(app_name, user_id, app_state, user_state)
+        except sqlite3.IntegrityError:
+            return None
+        merged = self._load_scoped_state(app_name, user_id)
+        merged.update(session_state)
+        return merged
+
+    def _db_get_session(
+        self,
+        key: SessionKey,
+        num_recent_events: Optional[int],
+        after_timestamp: Optional[float]
+    ) -> Optional[Tuple[Dict[str, Any], float, List[str]]]:
+        app_name, user_id, session_id = key
+        row = self._conn.execute(
+            "SELECT state, update_time FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?",
+            key
+        ).fetchone()
+        if row is None:
+            return None
+
+        state = self._load_scoped_state(app_name, user_id)
+        state.update(json.loads(row[0]))
+
+        query = "SELECT event FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?"
+        params: List[Any] = [app_name, user_id, session_id]
+        if after_timestamp is not None:
+            query += " AND timestamp >= ?"
+            params.append(after_timestamp)
+        query += " ORDER BY timestamp DESC, seq DESC"
+        if num_recent_events is not None:
+            query += " LIMIT ?"
+            params.append(num_recent_events)
+        events = [r[0] for r in self._conn.execute(query, params).fetchall()]
+        events.reverse()
+        return state, row[1], events
+
+    def _db_list_sessions(self, app_name: str, user_id: Optional[str]) -> List[Tuple[str, str, str, float]]:
+        if user_id is None:
+            rows = self._conn.execute(
+                "SELECT user_id, session_id, state, update_time FROM sessions WHERE app_name = ?",
+                (app_name,)
+            ).fetchall()
+        else:
+            rows = self._conn.execute(
+                "SELECT user_id, session_id, state, update_time FROM sessions WHERE app_name = ? AND user_id = ?",
+                (app_name, user_id)
+            ).fetchall()
+        return rows
+
+    def _db_delete_sessions(self, keys: List[SessionKey]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", keys
+            )
+            self._conn.executemany(
+                "DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", keys
+            )
+
+    def _db_expired_sessions(self, cutoff: float) -> List[SessionKey]:
+        return self._conn.execute(
+            "SELECT app_name, user_id, session_id FROM sessions WHERE update_time < ?", (cutoff,)
+        ).fetchall()
+
+    def _db_write_batch(self, batch: List[Tuple[SessionKey, Tuple[float, str], Tuple[Dict, Dict, Dict]]]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO events (app_name, user_id, session_id, timestamp, event) VALUES (?, ?, ?, ?, ?)",
+                [key + row for key, row, _ in batch]
+            )
+            # Merge state deltas per session so each session is written once per batch
+            session_deltas: Dict[SessionKey, Tuple[float, Dict, Dict, Dict]] = {}
+            for key, (timestamp, _), (app_delta, user_delta, session_delta) in batch:
+                _, apps, users, sessions = session_deltas.get(key, (timestamp, {}, {}, {}))
+                apps.update(app_delta)
+                users.update(user_delta)
+                sessions.update(session_delta)
+                session_deltas[key] = (timestamp, apps, users, sessions)
+
+            for key, (timestamp, app_delta, user_delta, session_delta) in session_deltas.items():
+                app_name, user_id, _ = key
+                self._merge_scoped_state(app_name, user_id, app_delta, user_delta)
+                if session_delta:
+                    row = self._conn.execute(
+                        "SELECT state FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+                    ).fetchone()
+                    state = json.loads(row[0]) if row else {}
+                    state.update(session_delta)
+                    self._conn.execute(
+                        "UPDATE sessions SET state = ?, update_time = ? "
+                        "WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                        (json.dumps(state), timestamp) + key
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE sessions SET update_time = ? "
+                        "WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                        (timestamp,) + key
+                    )
+
+    # ========== Batched Writes ==========
+
+    def _schedule_flush(self) -> None:
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self.flush())
+            self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: "asyncio.Task[None]") -> None:
+        """Retry a failed background flush later (its events were put back in the queue)"""
+        if task.cancelled() or task.exception() is None:
+            return
+        if self._flush_handle is None and self._conn is not None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(max(self.flush_interval, 1.0), self._start_flush)
+
+    async def flush(self) -> None:
+        """
+        Write all pending events to the database.
+        If the write fails, the events stay queued for the next flush.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                await self._run(self._db_write_batch, batch)
+            except Exception as e:
+                # The batch is one transaction, so nothing of it was written; keep it ahead of newer events
+                self._pending[:0] = batch
+                logger.error(f"Failed to write {len(batch)} session event(s): {e}")
+                raise
+
+    # ========== BaseSessionService ==========
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None
+    ) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        now = time.time()
+        merged = await self._run(self._db_create_session, (app_name, user_id, session_id), state or {}, now)
+        if merged is None:
+            raise ValueError(f"Session {session_id} already exists")
+        return Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=merged,
+            last_update_time=now
+        )
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None
+    ) -> Optional[Session]:
+        await self.flush()
+        result = await self._run(
+            self._db_get_session,
+            (app_name, user_id, session_id),
+            config.num_recent_events if config else None,
+            config.after_timestamp if config else None
+        )
+        if result is None:
+            return None
+
+        state, update_time, events = result
+        return Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=state,
+            events=[Event.model_validate_json(event) for event in events],
+            last_update_time=update_time
+        )
+
+    async def list_sessions(
+        self,
+        *,
+        app_name: str,
+        user_id: Optional[str] = None
+    ) -> ListSessionsResponse:
+        await self.flush()
+        rows = await self._run(self._db_list_sessions, app_name, user_id)
+        return ListSessionsResponse(sessions=[
+            Session(
+                id=session_id,
+                app_name=app_name,
+                user_id=row_user_id,
+                state=json.loads(state),
+                last_update_time=update_time
+            )
+            for row_user_id, session_id, state, update_time in rows
+        ])
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await self.flush()
+        await self._run(self._db_delete_sessions, [(app_name, user_id, session_id)])
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        """Apply the event to the session now and queue it for the next batched write"""
+        if event.partial:
+            return event
+
+        event = await super().append_event(session, event)
+        session.last_update_time = event.timestamp
+
+        state_delta = event.actions.state_delta if event.actions and event.actions.state_delta else {}
+        self._pending.append((
+            (session.app_name, session.user_id, session.id),
+            (event.timestamp, event.model_dump_json(exclude_none=True)),
+            _split_state(state_delta)
+        ))
+        self._schedule_flush()
+        return event
+
+    # ========== Maintenance ==========
+
+    async def purge_expired(self) -> int:
+        """
+        Delete sessions inactive for longer than ttl, with their events.
+
+        Returns:
+            Number of sessions deleted
+        """
+        if self.ttl <= 0:
+            return 0
+
+        await self.flush()
+        expired = await self._run(self._db_expired_sessions, time.time() - self.ttl)
+        if expired:
+            await self._run(self._db_delete_sessions, expired)
+            logger.info(f"Purged {len(expired)} expired session(s)")
+        return len(expired)
+
+    def start_purger(self, interval: float = 300.0) -> None:
+        """
+        Start a background task that purges expired sessions.
+        Must be called from a running event loop; does nothing if already running
+        or if sessions never expire.
+
+        Args:
+            interval: Seconds between purges
+        """
+        if self.ttl <= 0 or (self._purger is not None and not self._purger.done()):
+            return
+        self._purger = asyncio.ensure_future(self._purge_loop(interval))
+        logger.info(f"Session purger started (every {interval}s)")
+
+    async def stop_purger(self) -> None:
+        """Stop the background purge task"""
+        if self._purger is None:
+            return
+        self._purger.cancel()
+        try:
+            await self._purger
+        except asyncio.CancelledError:
+            pass
+        self._purger = None
+
+    async def _purge_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.purge_expired()
+            except Exception as e:
+                logger.error(f"Session purge failed: {e}")
+
+    async def close(self) -> None:
+        """Flush pending events and close the database"""
+        await self.stop_purger()
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
@@ -4,10 +4,32 @@ Combines validation, schema, and tool management in one place.
 """
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Tuple, Optional
+from typing import Awaitable, List, Dict, Any, Tuple, Optional
 from dataclasses import dataclass, asdict
+import asyncio
 import json
 import logging
+import time
+
+from .catalog_cache import (
+    ProductCache,
+    ProductLoader,
+    SingleFlight,
+    MISSING,
+    Quote,
+    VariationPrices,
+    DEFAULT_PRODUCT_CACHE_TTL,
+    DEFAULT_PRODUCT_CACHE_MAX_ENTRIES,
+    DEFAULT_PRODUCT_BATCH_WINDOW,
+    DEFAULT_PRODUCT_BATCH_MAX_SIZE,
+    DEFAULT_CATALOG_MAX_CONCURRENCY,
+    DEFAULT_MISSING_PRODUCT_TTL,
+    DEFAULT_MISSING_PRODUCT_MAX_ENTRIES,
+    build_variation_prices,
+    normalize_filters,
+    product_key,
+)
+from .cart_storage import VariationKey, variation_key
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +48,18 @@ class ValidationError(MerchantToolError):
     pass
 
 
+class ProductLookupError(MerchantToolError):
+    """
+    Raised by get_products_by_ids when some of the lookups failed.
+    Carries the products that were found and the error for each failed ID.
+    """
+    
+    def __init__(self, errors: Dict[str, BaseException], products: List[Dict[str, Any]]):
+        super().__init__(f"Product lookup failed for: {', '.join(errors)}")
+        self.errors = errors
+        self.products = products
+
+
 # ============================================================
 # Response Schema Classes (Enhanced)
 # ============================================================
@@ -333,6 +367,424 @@ class MerchantTools(ABC):
         """
         pass
     
+    # ========== Optional Overrides ==========
+    
+    async def get_products_by_ids(self, product_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Look up several products by exact product ID in one call.
+        Returns a list of product dicts (same shape as get_products); unknown
+        IDs are simply left out.
+        
+        Override this if your catalog supports bulk lookups. The default fans
+        out get_products(product_id=..., limit=1) calls, at most
+        catalog_max_concurrency at a time.
+        
+        Raises:
+            ProductLookupError: Some lookups failed (the others' products are attached)
+        """
+        async def lookup(product_id: str) -> List[Dict[str, Any]]:
+            async with self._catalog_limiter():
+                return await self.get_products(product_id=product_id, limit=1)
+        
+        results = await asyncio.gather(
+            *(lookup(product_id) for product_id in product_ids),
+            return_exceptions=True
+        )
+        
+        products: List[Dict[str, Any]] = []
+        errors: Dict[str, BaseException] = {}
+        for product_id, result in zip(product_ids, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                errors[product_id] = result
+            elif result:
+                products.append(result[0])
+        
+        if errors:
+            raise ProductLookupError(errors, products)
+        return products
+    
+    # ========== Product Cache ==========
+    
+    def configure_catalog_concurrency(self, max_concurrency: int = DEFAULT_CATALOG_MAX_CONCURRENCY) -> None:
+        """
+        Limit how many get_products calls the product cache makes at once.
+        
+        Args:
+            max_concurrency: Maximum get_products calls in flight
+        """
+        self._catalog_max_concurrency = max(1, max_concurrency)
+        self._catalog_limiter_state = None
+        logger.info(f"Catalog concurrency limited to {self._catalog_max_concurrency}")
+    
+    @property
+    def catalog_max_concurrency(self) -> int:
+        """Maximum get_products calls the product cache makes at once"""
+        return getattr(self, "_catalog_max_concurrency", DEFAULT_CATALOG_MAX_CONCURRENCY)
+    
+    def _catalog_limiter(self) -> asyncio.Semaphore:
+        """Semaphore bounding get_products calls, created in (and tied to) the running loop"""
+        loop = asyncio.get_running_loop()
+        state = getattr(self, "_catalog_limiter_state", None)
+        if state is None or state[0] is not loop:
+            state = self._catalog_limiter_state = (loop, asyncio.Semaphore(self.catalog_max_concurrency))
+        return state[1]
+    
+    def configure_product_cache(
+        self,
+        ttl: float = DEFAULT_PRODUCT_CACHE_TTL,
+        max_entries: int = DEFAULT_PRODUCT_CACHE_MAX_ENTRIES
+    ) -> None:
+        """
+        Configure the product cache in front of get_products.
+        
+        Args:
+            ttl: Seconds a cached product lookup stays valid (0 disables caching)
+            max_entries: Maximum cached lookups before LRU eviction
+        """
+        self._product_cache = ProductCache(ttl=ttl, max_entries=max_entries)
+        self._variation_price_cache = ProductCache(ttl=ttl, max_entries=max_entries)
+        self._quote_cache = ProductCache(ttl=ttl, max_entries=max_entries)
+        logger.info(f"Product cache configured: ttl={ttl}s, max_entries={max_entries}")
+    
+    @property
+    def product_cache(self) -> ProductCache:
+        """Product cache, created with defaults on first use"""
+        cache = getattr(self, "_product_cache", None)
+        if cache is None:
+            cache = self._product_cache = ProductCache()
+        return cache
+    
+    def configure_missing_product_cache(
+        self,
+        ttl: float = DEFAULT_MISSING_PRODUCT_TTL,
+        max_entries: int = DEFAULT_MISSING_PRODUCT_MAX_ENTRIES
+    ) -> None:
+        """
+        Configure the negative cache of product IDs the catalog didn't find.
+        Keeps repeated lookups of made-up IDs from reaching get_products.
+        
+        Args:
+            ttl: Seconds an ID is remembered as missing (0 disables negative caching)
+            max_entries: Maximum remembered IDs before LRU eviction
+        """
+        self._missing_product_cache = ProductCache(ttl=ttl, max_entries=max_entries)
+        logger.info(f"Missing product cache configured: ttl={ttl}s, max_entries={max_entries}")
+    
+    @property
+    def missing_product_cache(self) -> ProductCache:
+        """Product IDs recently not found, created with defaults on first use"""
+        cache = getattr(self, "_missing_product_cache", None)
+        if cache is None:
+            cache = self._missing_product_cache = ProductCache(
+                ttl=DEFAULT_MISSING_PRODUCT_TTL,
+                max_entries=DEFAULT_MISSING_PRODUCT_MAX_ENTRIES
+            )
+        return cache
+    
+    def _known_missing(self, product_id: str) -> bool:
+        cache = self.missing_product_cache
+        return cache.enabled and cache.get(product_key(product_id)) is not MISSING
+    
+    @property
+    def catalog_version(self) -> int:
+        """Bumped on every invalidation; lookups started under an older version aren't cached"""
+        return getattr(self, "_catalog_version", 0)
+    
+    def invalidate_product(self, product_id: str) -> None:
+        """
+        Drop everything cached about a product after its price, stock or details change
+        (e.g. from an inventory webhook). Cached search results are dropped too, since
+        the change may affect which products a search matches.
+        
+        Args:
+            product_id: Product that changed
+        """
+        self._catalog_version = self.catalog_version + 1
+        key = product_key(product_id)
+        self.product_cache.delete(key)
+        self.product_cache.delete_matching(lambda cached_key: cached_key[0] == "filters")
+        # The product may just have been added
+        self.missing_product_cache.delete(key)
+        self.variation_price_cache.delete(key)
+        self.invalidate_quotes(product_id)
+        logger.info(f"Invalidated cached product {product_id} (catalog version {self.catalog_version})")
+    
+    def invalidate_all(self) -> None:
+        """Drop all cached products, search results, variation tables and quotes"""
+        self._catalog_version = self.catalog_version + 1
+        self.product_cache.clear()
+        self.missing_product_cache.clear()
+        self.variation_price_cache.clear()
+        self.invalidate_quotes()
+        logger.info(f"Invalidated product cache (catalog version {self.catalog_version})")
+    
+    @property
+    def variation_price_cache(self) -> ProductCache:
+        """Variation price tables of recently priced products"""
+        cache = getattr(self, "_variation_price_cache", None)
+        if cache is None:
+            cache = self._variation_price_cache = ProductCache()
+        return cache
+    
+    def variation_prices(self, product: Dict[str, Any]) -> VariationPrices:
+        """
+        Get a product's {(type, name): price_modifier} table, built once per product record.
+        
+        Args:
+            product: Product dict as returned by get_products
+            
+        Returns:
+            Variation price table
+        """
+        cache = self.variation_price_cache
+        key = product_key(product["id"])
+        cached = cache.get(key) if cache.enabled else MISSING
+        # Tables are tied to the record they were built from, so a refreshed product gets a new one
+        if cached is not MISSING and cached[0] is product:
+            return cached[1]
+        
+        prices = build_variation_prices(product)
+        cache.set(key, (product, prices))
+        return prices
+    
+    @property
+    def quote_cache(self) -> ProductCache:
+        """Unit-price quotes by product, each a {variation key: quote} dict"""
+        cache = getattr(self, "_quote_cache", None)
+        if cache is None:
+            cache = self._quote_cache = ProductCache()
+        return cache
+    
+    def get_quote(self, product_id: str, variations: VariationKey) -> Optional[Quote]:
+        """
+        Get a cached unit-price quote for a product and canonical variation key.
+        
+        Args:
+            product_id: Product ID
+            variations: Canonical variation key (see cart_storage.variation_key)
+            
+        Returns:
+            (unit_price, product_name, product_image), or None if not cached
+        """
+        cache = self.quote_cache
+        if not cache.enabled:
+            return None
+        quotes = cache.get(product_key(product_id))
+        return None if quotes is MISSING else quotes.get(variations)
+    
+    def _store_quote(self, product_id: str, variations: VariationKey, quote: Quote) -> None:
+        cache = self.quote_cache
+        if not cache.enabled:
+            return
+        key = product_key(product_id)
+        quotes = cache.get(key)
+        if quotes is MISSING:
+            # Quotes added later share this entry's expiry, so none outlives its ttl
+            cache.set(key, {variations: quote})
+        else:
+            quotes[variations] = quote
+    
+    def invalidate_quotes(self, product_id: Optional[str] = None) -> None:
+        """
+        Drop cached unit-price quotes.
+        
+        Args:
+            product_id: Product whose quotes to drop (None drops all quotes)
+        """
+        if product_id is None:
+            self.quote_cache.clear()
+        else:
+            self.quote_cache.delete(product_key(product_id))
+    
+    @property
+    def product_flights(self) -> SingleFlight:
+        """Coalesces concurrent identical get_products calls"""
+        flights = getattr(self, "_product_flights", None)
+        if flights is None:
+            flights = self._product_flights = SingleFlight()
+        return flights
+    
+    def configure_product_loader(
+        self,
+        window: float = DEFAULT_PRODUCT_BATCH_WINDOW,
+        max_batch_size: int = DEFAULT_PRODUCT_BATCH_MAX_SIZE
+    ) -> None:
+        """
+        Configure batching of product ID lookups into get_products_by_ids calls.
+        
+        Args:
+            window: Seconds to collect lookups before dispatching (0 batches within one event-loop tick)
+            max_batch_size: Maximum product IDs per get_products_by_ids call
+        """
+        self._product_loader = ProductLoader(
+            self._load_products_batch,
+            window=window,
+            max_batch_size=max_batch_size
+        )
+        logger.info(f"Product loader configured: window={window}s, max_batch_size={max_batch_size}")
+    
+    @property
+    def product_loader(self) -> ProductLoader:
+        """Batches product ID lookups, created with defaults on first use"""
+        loader = getattr(self, "_product_loader", None)
+        if loader is None:
+            loader = self._product_loader = ProductLoader(self._load_products_batch)
+        return loader
+    
+    async def _load_products_batch(self, product_ids: List[str]) -> Dict[str, Any]:
+        """
+        Fetch one batch of product IDs and store them in the product cache.
+        Returns products by ID, with the exception as the value for IDs whose lookup failed.
+        """
+        cache = self.product_cache
+        wanted = set(product_ids)
+        found: Dict[str, Any] = {}
+        errors: Dict[str, BaseException] = {}
+        
+        version = self.catalog_version
+        try:
+            products = await self.get_products_by_ids(product_ids)
+        except ProductLookupError as e:
+            products = e.products
+            errors = {product_id: error for product_id, error in e.errors.items() if product_id in wanted}
+        # Don't cache results that may predate an invalidation
+        cacheable = version == self.catalog_version
+        for product in products or []:
+            if isinstance(product, dict) and product.get("id") in wanted:
+                found[product["id"]] = product
+                if cacheable:
+                    cache.set(product_key(product["id"]), product)
+        
+        # Remember IDs the catalog doesn't have (not ones whose lookup failed), so retries don't reach it again
+        if cacheable:
+            for product_id in wanted.difference(found, errors):
+                self.missing_product_cache.set(product_key(product_id), True)
+        
+        found.update(errors)
+        return found
+    
+    async def get_products_cached(
+        self, 
+        query: str = "", 
+        limit: int = 10,
+        product_id: Optional[str] = None,
+        name_contains: Optional[str] = None,
+        price_min: Optional[float] = None,
+        price_max: Optional[float] = None,
+        desc_contains: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Internal: get_products through the product cache.
+        Plain product_id lookups are batched through the product loader;
+        other identical in-flight queries are coalesced.
+        """
+        cache = self.product_cache
+        key = normalize_filters(query, limit, product_id, name_contains, price_min, price_max, desc_contains)
+        
+        # Plain product_id lookups are served from the per-product entries
+        id_lookup = key[3] is not None and limit >= 1 and key == normalize_filters(limit=limit, product_id=product_id)
+        
+        if cache.enabled:
+            cached = cache.get(product_key(key[3]) if id_lookup else key)
+            if cached is not MISSING:
+                return [cached] if id_lookup else cached
+        
+        if id_lookup:
+            if self._known_missing(key[3]):
+                return []
+            product = await self.product_loader.load(key[3])
+            return [product] if product is not None else []
+        
+        version = self.catalog_version
+        
+        async def load() -> List[Dict[str, Any]]:
+            async with self._catalog_limiter():
+                products = await self.get_products(query, limit, product_id, name_contains, price_min, price_max, desc_contains)
+            if isinstance(products, list) and version == self.catalog_version:
+                cache.set(key, products)
+                for product in products:
+                    if isinstance(product, dict) and isinstance(product.get("id"), str):
+                        cache.set(product_key(product["id"]), product)
+            return products
+        
+        # Keyed by version so callers after an invalidation don't join an older lookup
+        return await self.product_flights.do((version, key), load)
+    
+    async def get_products_by_ids_cached(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Internal: get_products_by_ids through the product cache, keyed by product ID"""
+        cache = self.product_cache
+        found: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        
+        for product_id in dict.fromkeys(product_ids):
+            cached = cache.get(product_key(product_id)) if cache.enabled else MISSING
+            if cached is MISSING:
+                if not self._known_missing(product_id):
+                    missing.append(product_id)
+            else:
+                found[product_id] = cached
+        
+        if missing:
+            found.update(await self.product_loader.load_many(missing))
+        
+        return found
+    
+    @property
+    def catalog_ready(self) -> bool:
+        """True once warm_catalog() has finished"""
+        return getattr(self, "_catalog_ready", False)
+    
+    async def warm_catalog(
+        self,
+        product_ids: Optional[List[str]] = None,
+        top_n: int = 0
+    ) -> int:
+        """
+        Prefetch products into the product cache so the first shoppers after
+        a deploy don't all hit a cold cache. IDs go through the product
+        loader, so catalog calls are bounded by its batch size and
+        catalog_max_concurrency. Failed lookups are logged and skipped;
+        catalog_ready is set when warm-up finishes.
+        
+        Args:
+            product_ids: Product IDs to prefetch
+            top_n: Also prefetch the first top_n products get_products returns for an empty query
+            
+        Returns:
+            Number of products cached
+        """
+        if not self.product_cache.enabled:
+            logger.info("Product cache disabled, skipping catalog warm-up")
+            self._catalog_ready = True
+            return 0
+        
+        started = time.monotonic()
+        ids = list(dict.fromkeys(product_ids or []))
+        lookups: List[Awaitable[Any]] = [self.product_loader.load(product_id) for product_id in ids]
+        if top_n > 0:
+            lookups.append(self.get_products_cached(limit=top_n))
+        
+        results = await asyncio.gather(*lookups, return_exceptions=True)
+        
+        warmed = set()
+        for index, result in enumerate(results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, BaseException):
+                logger.warning(f"Catalog warm-up lookup failed: {result}")
+            elif index < len(ids):
+                # Only count IDs the catalog returned a product for
+                if result is not None:
+                    warmed.add(ids[index])
+            elif isinstance(result, list):
+                warmed.update(p["id"] for p in result if isinstance(p, dict) and "id" in p)
+        
+        self._catalog_ready = True
+        logger.info(f"Catalog warmed: {len(warmed)} product(s) in {time.monotonic() - started:.2f}s")
+        return len(warmed)
+    
     # ========== Internal Methods (Do Not Override) ==========
     
     async def search_products(
@@ -347,7 +799,7 @@ class MerchantTools(ABC):
     ) -> str:
         """Internal: validates and converts get_products response"""
         # Call merchant's implementation
-        products_data = await self.get_products(query, limit, product_id, name_contains, price_min, price_max, desc_contains)
+        products_data = await self.get_products_cached(query, limit, product_id, name_contains, price_min, price_max, desc_contains)
         
         # Validate - will raise ValidationError if invalid
         valid, error = SchemaValidator.validate_products_list(products_data)
@@ -443,39 +895,48 @@ class MerchantTools(ABC):
         Args:
             items: List of dicts with product_id, quantity, variations (optional)
         
-        Returns: Dict with items, total_amount
+        Returns: Dict with items (including product_name and product_image), total_amount
         """
         order_items = []
         total_amount = 0.0
         
-        for item in items:
+        # Reuse recent quotes; look up the products of the rest in one batch
+        version = self.catalog_version
+        quotes = [self.get_quote(item["product_id"], variation_key(item.get("variations"))) for item in items]
+        unquoted_ids = [item["product_id"] for item, quote in zip(items, quotes) if quote is None]
+        products_by_id = await self.get_products_by_ids_cached(unquoted_ids) if unquoted_ids else {}
+        
+        for item, quote in zip(items, quotes):
             product_id = item["product_id"]
             quantity = item["quantity"]
             selected_variations = item.get("variations", [])
             
-            # Look up product by product_id
-            products_list = await self.get_products(product_id=product_id, limit=1)
-            
-            if not products_list or len(products_list) == 0:
-                raise ValueError(f"Product {product_id} not found")
-            
-            product = products_list[0]
-            product_name = product["name"]
-            
-            # Calculate price with variations
-            item_price = product["base_price"]
-            if selected_variations and product.get("variations"):
-                for selected_var in selected_variations:
-                    # Find matching variation and add price modifier
-                    for prod_var in product["variations"]:
-                        if prod_var["type"] == selected_var["type"] and prod_var["name"] == selected_var["name"]:
-                            item_price += prod_var["price_modifier"]
-                            break
+            if quote is not None:
+                item_price, product_name, product_image = quote
+            else:
+                product = products_by_id.get(product_id)
+                if not product:
+                    raise ValueError(f"Product {product_id} not found")
+                
+                product_name = product["name"]
+                product_image = product.get("image", "")
+                
+                # Calculate price with variations
+                item_price = product["base_price"]
+                if selected_variations and product.get("variations"):
+                    variation_prices = self.variation_prices(product)
+                    for selected_var in selected_variations:
+                        # Add the matching variation's price modifier
+                        item_price += variation_prices.get((selected_var["type"], selected_var["name"]), 0)
+                
+                if version == self.catalog_version:
+                    self._store_quote(product_id, variation_key(selected_variations), (item_price, product_name, product_image))
             
             # Add to order
             order_items.append({
                 "product_id": product_id,
                 "product_name": product_name,
+                "product_image": product_image,
                 "quantity": quantity,
                 "unit_price": item_price,
                 "variations": selected_variations if selected_variations else None,